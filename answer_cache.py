@@ -0,0 +1,122 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from name_index import tokenize_query
+
+# Entries kept, seconds an entry stays valid, and the cosine similarity a
+# differently-worded question needs to reuse an answer (None, the default,
+# disables the near-duplicate lookup: CodeBERT vectors aren't tuned for
+# sentence similarity, so questions about two different functions can
+# score above any useful threshold)
+ANSWER_CACHE_SIZE      = 512
+ANSWER_CACHE_TTL       = 24 * 3600
+ANSWER_CACHE_THRESHOLD = None
+
+
+def normalize_question(question):
+    """Case-, whitespace- and trailing-punctuation-insensitive cache key."""
+    return re.sub(r"\s+", " ", question).strip().rstrip("?!. ").lower()
+
+
+class AnswerCache:
+    """LRU + TTL cache of chat answers, scoped to an index version.
+
+    Keys are the normalised question plus the index version, so a
+    re-upload (new version) never serves answers about the old code.
+    If a similarity threshold is set and a query embedding is supplied, a
+    miss on the exact key falls back to the most similar cached question of
+    the same version that names the same identifiers (so "what does
+    process_rows do" never reuses the answer about compute_stats).
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL,
+                 similarity_threshold=ANSWER_CACHE_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()  # (version, question) -> entry
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _expired(self, entry, now):
+        return self.ttl is not None and now - entry["created"] > self.ttl
+
+    def lookup(self, question, version, embed=None):
+        """(cached entry or None, query vector or None).
+
+        ``embed`` is a zero-argument callable returning the query embedding;
+        it is only called when the exact key misses and the near-duplicate
+        lookup is enabled. The vector is returned so the caller can reuse it.
+        """
+        key = (version, normalize_question(question))
+        now = time.time()
+        vector = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                del self._entries[key]
+                entry = None
+        if entry is None and embed is not None and self.similarity_threshold is not None:
+            vector = embed()
+            with self._lock:
+                entry = self._nearest(version, vector, now, question)
+                if entry is not None:
+                    self.semantic_hits += 1
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None, vector
+            if entry["key"] in self._entries:
+                self._entries.move_to_end(entry["key"])
+            self.hits += 1
+            return entry, vector
+
+    def _nearest(self, version, vector, now, question):
+        query = np.asarray(vector, dtype="float32").ravel()
+        tokens = tokenize_query(question)
+        best, best_score = None, self.similarity_threshold
+        for (entry_version, _), entry in self._entries.items():
+            if entry_version != version or entry["vector"] is None or self._expired(entry, now):
+                continue
+            if entry["tokens"] != tokens:
+                continue
+            score = float(np.dot(entry["vector"], query))
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    def put(self, question, version, answer, sources, vector=None):
+        key = (version, normalize_question(question))
+        entry = {
+            "key": key,
+            "answer": answer,
+            "sources": sources,
+            "vector": None if vector is None else np.asarray(vector, dtype="float32").ravel(),
+            "tokens": tokenize_query(question),
+            "created": time.time(),
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+        }
@@ -1,41 +1,57 @@
 import os
-import zipfile
-import shutil
 import json
+import hashlib
+import threading
+from collections import OrderedDict
 
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
-from code_parser import parse_codebase
-from embed_functions import embed_parsed_functions
-from ask_question import ask_single_question
+from flask import Flask, Response, render_template, request, redirect, url_for, session, jsonify, stream_with_context
+from code_search import index_info, EXPANSION_LIMIT
+from ingest import IngestQueue, MODULES_JSON, new_job_id
+from code_parser import start_parse_pool
 from function_mapper import ModuleAnalyzer
+from call_graph import CALL_GRAPH_FILE, GraphView, build_call_graph
+from function_store import STORE_META_FILE, STORE_DATA_FILE, LEGACY_FUNCTIONS_FILE, load_function_store
+from workspaces import EnginePool, DEFAULT_WORKSPACE, valid_workspace_name, workspace_dir, list_workspaces
 
 UPLOAD_FOLDER   = 'uploads'
-EXTRACT_FOLDER  = 'workspace_code'
-MODULES_JSON    = 'modules_data.json'
+
+# Workspaces whose diagram graph / function store stay open between requests
+VIEW_CACHE_SIZE = 8
 
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-def build_modules_json(code_dir):
-    analyzer = ModuleAnalyzer()
-    analyzer.analyze_directory(code_dir, recursive=True)
-
-    modules_data = []
-    for module_name, info in analyzer.modules.items():
-        modules_data.append({
-            'name': module_name,
-            'path': info['path'],
-            'functions': [
-                { **({'calls': list(f['calls'])} if 'calls' in f else {}),
-                  **{k:v for k,v in f.items() if k!='calls'} }
-                for f in info['functions'].values()
-            ]
-        })
-
-    with open(MODULES_JSON, 'w', encoding='utf-8') as fp:
-        json.dump(modules_data, fp, indent=2)
-    return MODULES_JSON
+# parse workers (code_parser.parse_pool) import this module as __mp_main__;
+# only the serving process needs the engines and the ingest queue
+if __name__ != '__mp_main__':
+    # resident engines per workspace: the model is loaded once per process and
+    # each workspace's index stays loaded between requests until evicted
+    engines = EnginePool()
+
+    # ingestion runs in the background; the workspace's engine picks up the new
+    # artifacts once a job finishes
+    ingest_queue = IngestQueue(on_complete=lambda job: engines.reload(job.workspace))
+
+@app.before_request
+def select_workspace():
+    """?workspace=<name> (or a form field) switches this session's workspace."""
+    name = request.args.get('workspace') or request.form.get('workspace')
+    if name:
+        if not valid_workspace_name(name):
+            return jsonify({'error': f'Invalid workspace name {name!r}'}), 400
+        session['workspace'] = name
+
+def current_workspace():
+    return session.get('workspace', DEFAULT_WORKSPACE)
+
+@app.route('/workspaces')
+def workspaces():
+    return jsonify({
+        'current': current_workspace(),
+        'workspaces': list_workspaces(),
+        'engines': engines.stats(),
+    })
 
 @app.route('/')
 def welcome():
@@ -51,26 +67,32 @@ def upload():
     if not file or not file.filename.endswith('.zip'):
         return 'Please upload a ZIP file.', 400
 
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    zip_path = os.path.join(UPLOAD_FOLDER, file.filename)
+    workspace = current_workspace()
+    upload_dir = os.path.join(UPLOAD_FOLDER, workspace)
+    os.makedirs(upload_dir, exist_ok=True)
+    # one file per job: re-uploading the same name must not overwrite an
+    # archive a queued or running job is still reading
+    job_id = new_job_id()
+    zip_path = os.path.join(upload_dir, f"{job_id}.zip")
     file.save(zip_path)
 
-    # clean workspace
-    if os.path.exists(EXTRACT_FOLDER):
-        shutil.rmtree(EXTRACT_FOLDER)
-    os.makedirs(EXTRACT_FOLDER)
-
-    with zipfile.ZipFile(zip_path, 'r') as zf:
-        zf.extractall(EXTRACT_FOLDER)
-
-    # parse, embed, build modules JSON
-    parse_codebase(EXTRACT_FOLDER)
-    embed_parsed_functions()
-    build_modules_json(EXTRACT_FOLDER)
+    # extract, parse, embed and build the graph off the request thread;
+    # the archive is deleted when the job is done with it
+    job = ingest_queue.submit(zip_path, workspace_dir(workspace, create=True), workspace,
+                              job_id=job_id, remove_zip=True)
 
     session['history'] = []
-    # now send users to the Walkthrough page
-    return redirect(url_for('walkthrough'))
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(job.to_dict()), 202
+    # now send users to the Walkthrough page, which polls the job
+    return redirect(url_for('walkthrough', job=job.id))
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
 
 @app.route('/walkthrough')
 def walkthrough():
@@ -84,16 +106,189 @@ def diagram():
 def chatbot():
     return render_template('chatbot.html')
 
+def _cached(cache, artifact_dir, path, build):
+    """build() for a workspace's artifact, rebuilt when path changes; LRU-bounded."""
+    with _cache_lock:
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        entry = cache.get(artifact_dir)
+        if entry is None or entry['mtime'] != mtime:
+            entry = dict(build(), mtime=mtime)
+            cache[artifact_dir] = entry
+        cache.move_to_end(artifact_dir)
+        while len(cache) > VIEW_CACHE_SIZE:
+            cache.popitem(last=False)
+        return entry
+
+_cache_lock = threading.Lock()
+_graph_views = OrderedDict()    # artifact dir -> {'view', 'etag', 'mtime'}
+_stores = OrderedDict()         # artifact dir -> {'store', 'mtime'}
+
+def _resolve_saved_modules(modules_data, store):
+    """Fill in callees / store_index missing from an older modules_data.json.
+
+    Calls are resolved by ModuleAnalyzer; functions are matched to the
+    store by file and line, or by file and name when that is unique
+    (with no store, store_index stays None).
+    """
+    functions = [f for module in modules_data for f in module['functions']]
+    if any('callees' not in f for f in functions):
+        analyzer = ModuleAnalyzer()
+        analyzer.add_modules_data(modules_data)
+        analyzer.resolve_calls()
+        modules_data = [{'name': name, 'path': info['path'], 'functions': list(info['functions'].values())}
+                        for name, info in analyzer.modules.items()]
+    by_line, by_name = {}, {}
+    for i in range(len(store) if store is not None else 0):
+        meta = store.meta(i)
+        by_line[(meta['file'], meta.get('line_number'))] = i
+        by_name.setdefault((meta['file'], meta['function_name']), []).append(i)
+    for module in modules_data:
+        for func in module['functions']:
+            if func.get('store_index') is None:
+                index = by_line.get((module['path'], func.get('line_number')))
+                if index is None:
+                    names = by_name.get((module['path'], func['name']), [])
+                    index = names[0] if len(names) == 1 else None
+                func['store_index'] = index
+    return modules_data
+
+def _call_graph_view(artifact_dir):
+    """(GraphView, content hash) of a workspace's call graph."""
+    graph_path = os.path.join(artifact_dir, CALL_GRAPH_FILE)
+    modules_path = os.path.join(artifact_dir, MODULES_JSON)
+
+    def build():
+        graph = None
+        if os.path.exists(graph_path):
+            with open(graph_path, 'rb') as fp:
+                body = fp.read()
+            graph = json.loads(body)
+        if graph is None or 'clusters' not in graph:
+            # artifacts from before the graph was precomputed / clustered,
+            # or nothing uploaded to this workspace yet
+            modules_data = []
+            if os.path.exists(modules_path):
+                with open(modules_path, encoding='utf-8') as fp:
+                    modules_data = json.load(fp)
+            modules_data = _resolve_saved_modules(modules_data, store)
+            graph = build_call_graph(modules_data)
+            body = json.dumps(graph).encode('utf-8')
+        return {'view': GraphView(graph), 'etag': hashlib.sha1(body).hexdigest()}
+
+    # opened up front: _cached holds the (non-reentrant) cache lock during build()
+    store = _function_store(artifact_dir)
+    entry = _cached(_graph_views, artifact_dir, graph_path, build)
+    return entry['view'], entry['etag']
+
+def _function_store(artifact_dir):
+    """A workspace's function store, reopened when a new ingest replaces it.
+
+    None while nothing has been uploaded to the workspace.
+    """
+    def build():
+        path = lambda name: os.path.join(artifact_dir, name)
+        if not os.path.exists(path(STORE_META_FILE)) and not os.path.exists(path(LEGACY_FUNCTIONS_FILE)):
+            return {'store': None}
+        return {'store': load_function_store(path(STORE_META_FILE), path(STORE_DATA_FILE),
+                                             path(LEGACY_FUNCTIONS_FILE))}
+    return _cached(_stores, artifact_dir, os.path.join(artifact_dir, STORE_META_FILE), build)['store']
+
+def _source_version(workspace, store_hash):
+    """Version of a workspace's /functions/<i> responses: its store's content."""
+    return f"{workspace}-{store_hash[:16]}" if store_hash else None
+
+@app.route('/functions/<int:index>')
+def function_source(index):
+    """Docstring + source of one function, read from the store by offset.
+
+    The diagram requests it as /functions/<i>?workspace=<ws>&v=<version>;
+    when the version is the current store's, the response can never change
+    for that URL and the browser may keep it.
+    """
+    workspace = current_workspace()
+    store = _function_store(workspace_dir(workspace))
+    if store is None or not 0 <= index < len(store):
+        return jsonify({'error': f'Unknown function {index}'}), 404
+    record = store[index]
+    response = jsonify({
+        'name': record['function_name'],
+        'qualified_name': record.get('qualified_name'),
+        'file': record['file'],
+        'line_number': record.get('line_number'),
+        'end_line': record.get('end_line'),
+        'docstring': record.get('docstring'),
+        'code': record['code'],
+    })
+    version = request.args.get('v')
+    if version and version == _source_version(workspace, store.content_hash):
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/diagram-data')
 def diagram_data():
-    with open(MODULES_JSON, encoding='utf-8') as fp:
-        return jsonify(json.load(fp))
+    """Whole graph or cluster overview; ?module=<cluster>&page=N expands one cluster."""
+    workspace = current_workspace()
+    artifact_dir = workspace_dir(workspace)
+    view, etag = _call_graph_view(artifact_dir)
+    # graphs from ingest name the store they index; older ones use the current store
+    store = _function_store(artifact_dir)
+    store_hash = view.graph.get('store_version') or (store.content_hash if store is not None else None)
+    version = _source_version(workspace, store_hash)
+    etag = f"{etag}-{version}"
+    module = request.args.get('module')
+    if module is None:
+        payload = view.overview()
+    else:
+        page = request.args.get('page', 0, type=int)
+        payload = view.cluster_page(module, max(page, 0))
+        if payload is None:
+            return jsonify({'error': f'Unknown module {module!r}'}), 404
+        etag = f"{etag}-{hashlib.sha1(module.encode('utf-8')).hexdigest()[:12]}-{page}"
+    # lets the client version its /functions/<i> URLs
+    payload['version'] = version
+    payload['workspace'] = workspace
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @app.route('/chat', methods=['POST'])
 def chat():
     q = request.json.get('question', '')
-    answer = ask_single_question(q)
-    return jsonify({'answer': answer})
+    # "expand": number of call-graph neighbours to add to the hits (false/0 = none)
+    value = request.json.get('expand', EXPANSION_LIMIT)
+    try:
+        expand = int(value or 0)
+    except (TypeError, ValueError):
+        expand = -1
+    if expand < 0:
+        return jsonify({'error': f'Invalid expand value {value!r}'}), 400
+    engine = engines.get(current_workspace())
+    if request.json.get('stream') or request.accept_mimetypes.best == 'text/event-stream':
+        # server-sent events: one "data:" line per engine event
+        events = (f"data: {json.dumps(event)}\n\n" for event in engine.ask_stream(q, expand=expand))
+        return Response(stream_with_context(events), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    return jsonify(engine.ask(q, expand=expand))
+
+@app.route('/engine-stats')
+def engine_stats():
+    engine = engines.get(current_workspace())
+    return jsonify({
+        'workspace': current_workspace(),
+        'ready': engine.ready,
+        'index': index_info(engine.metadata),
+        'latency': engine.latency_stats(),
+        'answer_cache': engine.answer_cache.stats(),
+        'query_cache': engine.encoder.stats() if engine.encoder else None,
+        'search_batching': engine.search_batcher.stats(),
+        'pool': engines.stats(),
+    })
 
 if __name__ == '__main__':
-    app.run(debug=True, use_reloader=False)
+    engines.get(DEFAULT_WORKSPACE).warm_up()
+    # started before any request threads exist, and kept for every upload
+    start_parse_pool()
+    app.run(debug=True, use_reloader=False, threaded=True)
@@ -1,4 +1,5 @@
 from code_search import load_all, find_top_functions
+from context_builder import build_context, CONTEXT_TOKEN_BUDGET
 import ollama
 
 # 🔄 Chat loop for CLI use (optional)
@@ -23,36 +24,53 @@ def ask_single_question(question):
 def generate_response(question, model, index, function_data, k=3):
     try:
         top_function_indices = find_top_functions(question, model, index, function_data, k)
-        code_blocks = ""
+        functions = [function_data[idx] for idx in top_function_indices]
+        return answer_from_functions(question, functions)
 
-        for rank, idx in enumerate(top_function_indices):
-            func = function_data[idx]
-            code_blocks += f"\n#{rank+1} — From {func['file']}:\n```python\n{func['code']}\n```\n"
+    except Exception as e:
+        return f"❌ Error generating response: {e}"
 
-        prompt = f"""
-        You are an AI assistant helping a junior developer understand a codebase.
+LLM_MODEL = 'llama3.2:latest'
+SYSTEM_PROMPT = "You are a helpful assistant that explains Python code clearly."
 
-        The user asked:
-        \"{question}\"
+# 🧾 Prompt for already-retrieved functions, packed into a token budget
+def build_prompt(question, functions, token_budget=CONTEXT_TOKEN_BUDGET):
+    code_blocks, report = build_context(question, functions, token_budget)
+    print(f"🧾 Context: ~{report['tokens']}/{report['budget']} tokens, "
+          f"{report['included']} hits ({report['truncated']} truncated, "
+          f"{report['compact']} compact, {report['deduplicated']} deduplicated)")
 
-        Here are the top {k} most relevant functions in the codebase:
+    return f"""
+    You are an AI assistant helping a junior developer understand a codebase.
 
-        {code_blocks}
+    The user asked:
+    \"{question}\"
 
-        Based on the most relevant function(s) below, answer the user's question directly and only refer to the relevant code.
-        """
+    Here are {report['included']} functions from the codebase, most relevant first (some may only be called by them):
 
-        response = ollama.chat(
-            model='llama3.2:latest',
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that explains Python code clearly."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        return response['message']['content']
+    {code_blocks}
 
-    except Exception as e:
-        return f"❌ Error generating response: {e}"
+    Lower-ranked functions may be shown as signatures only, and long functions with "lines omitted" markers.
+    Based on the most relevant function(s) above, answer the user's question directly and only refer to the relevant code.
+    """
+
+def _messages(question, functions, token_budget=CONTEXT_TOKEN_BUDGET):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": build_prompt(question, functions, token_budget)}
+    ]
+
+# 🧠 LLM call for already-retrieved functions (used by the query engine)
+def answer_from_functions(question, functions, token_budget=CONTEXT_TOKEN_BUDGET):
+    response = ollama.chat(model=LLM_MODEL, messages=_messages(question, functions, token_budget))
+    return response['message']['content']
+
+# 🌊 Same, but yields the answer piece by piece as the model generates it
+def stream_answer_from_functions(question, functions, token_budget=CONTEXT_TOKEN_BUDGET):
+    for chunk in ollama.chat(model=LLM_MODEL, messages=_messages(question, functions, token_budget), stream=True):
+        text = chunk.get('message', {}).get('content', '')
+        if text:
+            yield text
 
 # ✅ Run standalone (CLI usage)
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+import json
+import math
+import keyword
+from collections import Counter
+
+from name_index import STOPWORDS, split_identifier, _IDENTIFIER
+from function_store import write_json_atomically
+
+BM25_INDEX_FILE = "bm25_index.json"
+
+# Standard Okapi BM25 parameters
+BM25_K1 = 1.5
+BM25_B  = 0.75
+
+_IGNORED = STOPWORDS | set(keyword.kwlist) | {"self", "cls"}
+
+
+def tokenize_code(text):
+    """Identifier tokens of code or prose: whole identifiers plus their parts."""
+    tokens = []
+    for word in _IDENTIFIER.findall(text or ""):
+        lowered = word.lower()
+        if lowered in _IGNORED:
+            continue
+        tokens.append(lowered)
+        parts = split_identifier(word)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p not in _IGNORED and len(p) > 1)
+    return tokens
+
+
+class BM25Index:
+    """Sparse BM25 index over each function's name, docstring and code."""
+
+    def __init__(self, postings, doc_lengths):
+        self.postings = postings        # token -> [[function index, term freq], ...]
+        self.doc_lengths = doc_lengths
+        self.count = len(doc_lengths)
+        self.avg_length = (sum(doc_lengths) / self.count) if self.count else 0.0
+
+    @classmethod
+    def build(cls, functions):
+        postings = {}
+        doc_lengths = []
+        for i, func in enumerate(functions):
+            tokens = tokenize_code(
+                f"{func['function_name']}\n{func.get('docstring') or ''}\n{func['code']}"
+            )
+            doc_lengths.append(len(tokens))
+            for token, tf in Counter(tokens).items():
+                postings.setdefault(token, []).append([i, tf])
+        return cls(postings, doc_lengths)
+
+    @classmethod
+    def load(cls, path=BM25_INDEX_FILE):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["postings"], data["doc_lengths"])
+
+    def save(self, path=BM25_INDEX_FILE):
+        write_json_atomically(path, {"postings": self.postings, "doc_lengths": self.doc_lengths})
+
+    def search(self, question, limit=None):
+        """[(function index, bm25 score)] best first."""
+        scores = {}
+        for token in set(tokenize_code(question)):
+            posting = self.postings.get(token)
+            if not posting:
+                continue
+            df = len(posting)
+            idf = math.log(1 + (self.count - df + 0.5) / (df + 0.5))
+            for i, tf in posting:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[i] / (self.avg_length or 1))
+                scores[i] = scores.get(i, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit else ranked
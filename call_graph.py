@@ -0,0 +1,358 @@
+import json
+import math
+
+from function_store import write_json_atomically
+
+CALL_GRAPH_FILE     = "call_graph.json"
+CALL_ADJACENCY_FILE = "call_adjacency.json"
+
+# Up to this many functions /diagram-data sends the whole graph; above it the
+# client starts from the cluster overview and expands clusters on demand
+DIAGRAM_FULL_LIMIT = 500
+
+# Most clusters in the overview (package levels are folded until it fits)
+# and functions per page when a cluster is expanded
+MAX_CLUSTERS      = 300
+CLUSTER_PAGE_SIZE = 200
+
+# Precomputed layout: horizontal gap between nodes, vertical gap between
+# layers (px), widest row before a layer wraps, and barycenter sweeps used
+# to reduce edge crossings
+NODE_SPACING   = 220
+LAYER_SPACING  = 140
+MAX_LAYER_ROW  = 12
+ORDER_SWEEPS   = 4
+
+
+def node_id(module_name, qualified_name):
+    return f"{module_name}.{qualified_name}"
+
+
+def cluster_id(key):
+    # prefixed so a package can't collide with a function id
+    return f"cluster:{key}"
+
+
+def cluster_key(module_name, depth):
+    return '.'.join(module_name.split('.')[:depth])
+
+
+def _cluster_depth(module_names):
+    """Deepest package level whose cluster count stays within MAX_CLUSTERS."""
+    max_depth = max((len(m.split('.')) for m in module_names), default=1)
+    for depth in range(max_depth, 0, -1):
+        if len({cluster_key(m, depth) for m in module_names}) <= MAX_CLUSTERS:
+            return depth, max_depth
+    return 1, max_depth
+
+
+def _acyclic(ids, edges):
+    """Successor lists with back edges (found by DFS in id order) dropped."""
+    succ = {i: [] for i in ids}
+    for a, b in edges:
+        if a in succ and b in succ and a != b and b not in succ[a]:
+            succ[a].append(b)
+    state = {}
+    dag = {i: [] for i in ids}
+    for root in ids:
+        if root in state:
+            continue
+        state[root] = 1
+        stack = [(root, iter(succ[root]))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if state.get(child) == 1:      # back edge: would close a cycle
+                    continue
+                dag[node].append(child)
+                if child not in state:
+                    state[child] = 1
+                    stack.append((child, iter(succ[child])))
+                    break
+            else:
+                state[node] = 2
+                stack.pop()
+    return dag
+
+
+def _assign_layers(ids, dag):
+    """Longest-path layering: every edge points to a lower layer."""
+    indegree = {i: 0 for i in ids}
+    for children in dag.values():
+        for child in children:
+            indegree[child] += 1
+    layer = {i: 0 for i in ids}
+    ready = [i for i in ids if not indegree[i]]
+    while ready:
+        node = ready.pop()
+        for child in dag[node]:
+            layer[child] = max(layer[child], layer[node] + 1)
+            indegree[child] -= 1
+            if not indegree[child]:
+                ready.append(child)
+    return layer
+
+
+def _order_layers(layers, dag):
+    """Barycenter sweeps (down, then up) to reduce crossings; deterministic."""
+    preds = {}
+    for node, children in dag.items():
+        for child in children:
+            preds.setdefault(child, []).append(node)
+
+    def sweep(rows, neighbours):
+        for r in range(1, len(rows)):
+            pos = {n: i for i, n in enumerate(rows[r - 1])}
+            def key(item):
+                i, n = item
+                linked = [pos[m] for m in neighbours.get(n, ()) if m in pos]
+                return (sum(linked) / len(linked) if linked else i, i)
+            rows[r] = [n for _, n in sorted(enumerate(rows[r]), key=key)]
+
+    for _ in range(ORDER_SWEEPS):
+        sweep(layers, preds)
+        layers.reverse()
+        sweep(layers, dag)
+        layers.reverse()
+    return layers
+
+
+def layered_layout(ids, edges, sizes=None):
+    """Deterministic layered (Sugiyama-style) layout of a call graph.
+
+    Cycles are broken, nodes are layered so calls point downwards, each
+    layer is ordered by barycenter sweeps and wrapped after MAX_LAYER_ROW
+    nodes. ``sizes`` maps an id to the (width, height) of its box (nodes
+    default to a point). Returns {id: (x, y)} box centres, centred on x=0.
+    """
+    if not ids:
+        return {}
+    sizes = sizes or {}
+    dag = _acyclic(ids, edges)
+    layer = _assign_layers(ids, dag)
+    layers = [[] for _ in range(max(layer.values()) + 1)]
+    for i in ids:
+        layers[layer[i]].append(i)
+    layers = _order_layers(layers, dag)
+
+    positions = {}
+    y = 0.0
+    for row_nodes in layers:
+        for start in range(0, len(row_nodes), MAX_LAYER_ROW):
+            row = row_nodes[start:start + MAX_LAYER_ROW]
+            dims = [sizes.get(n, (0, 0)) for n in row]
+            width = sum(w for w, _ in dims) + NODE_SPACING * (len(row) - 1)
+            height = max(h for _, h in dims)
+            x = -width / 2
+            for n, (w, _) in zip(row, dims):
+                positions[n] = (x + w / 2, y + height / 2)
+                x += w + NODE_SPACING
+            y += height + LAYER_SPACING
+    return positions
+
+
+def layout_clusters(nodes_by_cluster, edges):
+    """Lay out functions inside each cluster, then the clusters themselves.
+
+    Both levels use layered_layout; a cluster's box is the extent of its
+    own layout. Sets absolute ``x``/``y`` on every node and returns
+    {key: (x, y)}, the centre of each cluster's box.
+    """
+    cluster_of = {n['id']: key for key, nodes in nodes_by_cluster.items() for n in nodes}
+    inner, outer = {}, []
+    for edge in edges:
+        a, b = cluster_of.get(edge['from']), cluster_of.get(edge['to'])
+        if a is None or b is None:
+            continue
+        if a == b:
+            inner.setdefault(a, []).append((edge['from'], edge['to']))
+        else:
+            outer.append((a, b))
+
+    local, sizes = {}, {}
+    for key, nodes in nodes_by_cluster.items():
+        positions = layered_layout([n['id'] for n in nodes], inner.get(key, []))
+        xs = [x for x, _ in positions.values()]
+        ys = [y for _, y in positions.values()]
+        cx, cy = (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2
+        local[key] = {i: (x - cx, y - cy) for i, (x, y) in positions.items()}
+        sizes[key] = (max(xs) - min(xs), max(ys) - min(ys))
+
+    centres = layered_layout(list(nodes_by_cluster), outer, sizes)
+    for key, nodes in nodes_by_cluster.items():
+        cx, cy = centres[key]
+        for node in nodes:
+            dx, dy = local[key][node['id']]
+            node['x'], node['y'] = round(cx + dx), round(cy + dy)
+    return centres
+
+
+def build_call_graph(modules_data):
+    """Turn modules data into a vis.js-ready graph, once, at ingest time.
+
+    Returns {'nodes': [...], 'edges': [...], 'clusters': {...}}. Edges come
+    from the ``callees`` ModuleAnalyzer.resolve_calls() resolved through
+    each module's imports; the rest of a node's calls are listed under
+    ``external``. Nodes carry structural fields only (a node's resolved
+    calls are its outgoing edges; docstring and source are served per
+    function from the store via ``store_index``), plus their cluster and
+    precomputed layered position. ``clusters`` is the
+    collapsed module/package-level view with call counts as edge weights.
+    """
+    depth, max_depth = _cluster_depth([m['name'] for m in modules_data])
+    nodes, edges = [], []
+    nodes_by_cluster = {}
+    for module in modules_data:
+        key = cluster_key(module['name'], depth)
+        for func in module['functions']:
+            fid = node_id(module['name'], func['qualified_name'])
+            edges.extend({'from': fid, 'to': target} for target in func.get('callees', []))
+            node = {
+                'id': fid,
+                'label': func['name'],
+                'module': module['name'],
+                'cluster': key,
+                'line_number': func.get('line_number'),
+                'end_line': func.get('end_line'),
+                'params': func.get('params', []),
+                'store_index': func.get('store_index'),
+                'external': func.get('external', []),
+            }
+            nodes.append(node)
+            nodes_by_cluster.setdefault(key, []).append(node)
+
+    centres = layout_clusters(nodes_by_cluster, edges)
+    cluster_of = {n['id']: n['cluster'] for n in nodes}
+    weights = {}
+    for edge in edges:
+        a, b = cluster_of[edge['from']], cluster_of.get(edge['to'])
+        if b is not None and a != b:
+            weights[(a, b)] = weights.get((a, b), 0) + 1
+    clusters = {
+        'level': 'module' if depth == max_depth else 'package',
+        'nodes': [{
+            'id': cluster_id(key),
+            'key': key,
+            'label': f"{key} ({len(members)})",
+            'size': len(members),
+            'x': round(centres[key][0]),
+            'y': round(centres[key][1]),
+        } for key, members in nodes_by_cluster.items()],
+        'edges': [{'from': cluster_id(a), 'to': cluster_id(b), 'weight': w}
+                  for (a, b), w in sorted(weights.items())],
+    }
+    return {'nodes': nodes, 'edges': edges, 'clusters': clusters}
+
+
+def write_call_graph(graph, path=CALL_GRAPH_FILE):
+    return write_json_atomically(path, graph, separators=(',', ':'))
+
+
+class CallAdjacency:
+    """Resolved calls keyed by function-store index, for retrieval expansion.
+
+    Built from the call graph at ingest time so expanding a search hit is a
+    couple of list lookups instead of a re-parse. Stored as one callee list
+    per store index; callers are derived on load.
+    """
+
+    def __init__(self, callees):
+        self.callees = callees
+        self.callers = [[] for _ in callees]
+        for caller, targets in enumerate(callees):
+            for callee in targets:
+                self.callers[callee].append(caller)
+
+    @classmethod
+    def from_graph(cls, graph):
+        store_of = {n['id']: n['store_index'] for n in graph['nodes'] if n.get('store_index') is not None}
+        callees = [[] for _ in range(max(store_of.values(), default=-1) + 1)]
+        for edge in graph['edges']:
+            a, b = store_of.get(edge['from']), store_of.get(edge['to'])
+            if a is not None and b is not None and a != b and b not in callees[a]:
+                callees[a].append(b)
+        return cls(callees)
+
+    @classmethod
+    def load(cls, path=CALL_ADJACENCY_FILE):
+        with open(path, 'r', encoding='utf-8') as fp:
+            return cls(json.load(fp)['callees'])
+
+    def save(self, path=CALL_ADJACENCY_FILE):
+        return write_json_atomically(path, {'callees': self.callees}, separators=(',', ':'))
+
+    def neighbours(self, seeds, depth=1, callers=False):
+        """{index: (distance, via)} reachable from seeds within depth calls.
+
+        Follows callees (and callers too if asked), breadth first; ``via``
+        is the seed the neighbour was reached from. Seeds are excluded.
+        """
+        seeds = [s for s in seeds if 0 <= s < len(self.callees)]
+        found = {}
+        frontier = [(s, s) for s in seeds]
+        seen = set(seeds)
+        for distance in range(1, depth + 1):
+            next_frontier = []
+            for node, via in frontier:
+                linked = self.callees[node] + (self.callers[node] if callers else [])
+                for other in linked:
+                    if other not in seen:
+                        seen.add(other)
+                        found[other] = (distance, via)
+                        next_frontier.append((other, via))
+            frontier = next_frontier
+        return found
+
+
+class GraphView:
+    """Read-side slices of a call graph for /diagram-data.
+
+    Small graphs are served whole; large ones as the cluster overview plus
+    one page of a cluster's functions at a time. Edges leaving a page name
+    both endpoints and their clusters, so the client can attach them to
+    whatever is rendered (the function, or its collapsed cluster).
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.by_id = {n['id']: n for n in graph['nodes']}
+        self.members = {}
+        for node in graph['nodes']:
+            self.members.setdefault(node['cluster'], []).append(node)
+        self.touching = {}
+        for edge in graph['edges']:
+            self.touching.setdefault(edge['from'], []).append(edge)
+            if edge['to'] != edge['from']:
+                self.touching.setdefault(edge['to'], []).append(edge)
+
+    def overview(self):
+        if len(self.graph['nodes']) <= DIAGRAM_FULL_LIMIT:
+            return {'level': 'function', 'nodes': self.graph['nodes'], 'edges': self.graph['edges']}
+        clusters = self.graph['clusters']
+        return {'level': clusters['level'], 'nodes': clusters['nodes'], 'edges': clusters['edges']}
+
+    def cluster_page(self, key, page=0, page_size=CLUSTER_PAGE_SIZE):
+        """One page of a cluster's functions plus every edge touching them; None if unknown."""
+        members = self.members.get(key)
+        if members is None:
+            return None
+        nodes = members[page * page_size:(page + 1) * page_size]
+        edges, seen = [], set()
+        for node in nodes:
+            for edge in self.touching.get(node['id'], []):
+                pair = (edge['from'], edge['to'])
+                if pair in seen or edge['to'] not in self.by_id:
+                    continue
+                seen.add(pair)
+                edges.append(dict(edge,
+                                  from_cluster=cluster_id(self.by_id[edge['from']]['cluster']),
+                                  to_cluster=cluster_id(self.by_id[edge['to']]['cluster'])))
+        return {
+            'level': 'function',
+            'cluster': cluster_id(key),
+            'page': page,
+            'pages': max(1, math.ceil(len(members) / page_size)),
+            'total': len(members),
+            'nodes': nodes,
+            'edges': edges,
+        }
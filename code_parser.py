@@ -1,6 +1,29 @@
 import os
-import ast
 import json
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from function_mapper import extract_file
+from function_store import write_function_store, write_json_atomically, STORE_META_FILE, STORE_DATA_FILE
+
+FILE_MANIFEST = "file_manifest.json"
+
+# Bumped whenever the record shape changes, so cached records are re-parsed
+RECORD_VERSION = 4
+
+# Worker processes for parsing. Each is a separate interpreter that
+# imports the main module (the whole web app, when run from app.py), so a
+# few are plenty. Small trees are parsed in-process since handing files to
+# the pool costs more than it saves.
+PARSE_WORKERS      = min(4, os.cpu_count() or 1)
+PARALLEL_MIN_FILES = 50
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
 
 def safe_read_file(file_path):
     try:
@@ -14,80 +37,241 @@ def safe_read_file(file_path):
             print(f"❌ Could not read {file_path}: {e}")
             return None
 
-def extract_functions_from_file(file_path):
-    source = safe_read_file(file_path)
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def load_file_manifest(path=FILE_MANIFEST):
+    """{file_path: {'sha256': ..., 'version': ..., 'records': [...], 'imports': {...}}} from the previous parse."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable {path}: {e}")
+        return {}
+
+def extract_functions_from_file(file_path, source=None):
+    """Unified per-function records for one file (see extract_file)."""
+    return _extract(file_path, source)[0]
+
+def _extract(file_path, source=None):
+    """(records, import table) for one file; empty for unreadable or invalid files."""
     if source is None:
-        return []
+        source = safe_read_file(file_path)
+    if source is None:
+        return [], {}
 
     try:
-        tree = ast.parse(source)
+        return extract_file(file_path, source)
     except SyntaxError as e:
         print(f"❌ SyntaxError in {file_path}: {e}")
-        return []
-
-    lines = source.splitlines()
-    functions = []
-
-    for node in ast.walk(tree):
-        if isinstance(node, ast.FunctionDef):
-            name = node.name
-            args = [arg.arg for arg in node.args.args]
-            docstring = ast.get_docstring(node)
-
-            start_line = node.lineno - 1
-            end_line = getattr(node, 'end_lineno', start_line + 20)
-            function_code = "\n".join(lines[start_line:end_line])
-
-            functions.append({
-                'file': file_path,
-                'function_name': name,
-                'args': args,
-                'docstring': docstring,
-                'code': function_code
-            })
-
-    return functions
-
-def parse_python_files_in_directory(directory):
-    print(f"🚀 Extracting functions...")
-    all_functions = []
-    
+        return [], {}
+
+def file_imports(manifest):
+    """{file_path: import table} of a parse, for ModuleAnalyzer.add_file_map."""
+    return {path: entry.get('imports') for path, entry in manifest.items()}
+
+def to_parsed_function(record):
+    """Shape of one entry in the function store (formerly parsed_functions.json)."""
+    return {
+        'file': record['file'],
+        'function_name': record['name'],
+        'qualified_name': record['qualified_name'],
+        'args': record['args'],
+        'docstring': record['docstring'],
+        'line_number': record['line_number'],
+        'end_line': record['end_line'],
+        'code': "\n".join(record['source'].splitlines())
+    }
+
+def list_python_files(directory, recursive=True):
+    """Sorted .py paths under directory, skipping macOS metadata."""
+    paths = []
     for root, dirs, files in os.walk(directory):
+        dirs.sort()
         # Skip macOS system directories
         if "__MACOSX" in root:
             continue
-            
-        for file in files:
+
+        for file in sorted(files):
             # Skip macOS metadata files and non-python files
             if file.startswith("._") or not file.endswith(".py"):
                 continue
-                
-            path = os.path.join(root, file)
-            print(f"\n📄 Parsing: {path}")
-            try:
-                functions = extract_functions_from_file(path)
-                all_functions.extend(functions)
-            except ValueError as e:
-                print(f"⚠️ Error parsing {path}: {e}")
-                continue
-            except Exception as e:
-                print(f"⚠️ Unexpected error parsing {path}: {e}")
-                continue
-    
-    return all_functions
+            paths.append(os.path.join(root, file))
+
+        if not recursive:
+            break
+    return paths
+
+def _parse_source_job(job):
+    """Worker: (path, source, cached_sha256) -> (path, sha256, (records, imports), error).
+
+    The parse is None when parsing failed unexpectedly, or when the source
+    is unchanged since the cached hash (the caller reuses its records).
+    """
+    path, source, cached_digest = job
+    try:
+        digest = content_hash(source)
+        if digest == cached_digest:
+            return path, digest, None, None
+        return path, digest, _extract(path, source), None
+    except Exception as e:
+        return path, None, None, str(e)
+
+def _parse_file_job(job):
+    """Worker: (path, cached_sha256) -> same as _parse_source_job, reading the file."""
+    path, cached_digest = job
+    try:
+        source = safe_read_file(path)
+    except Exception as e:
+        return path, None, None, str(e)
+    if source is None:
+        return path, None, None, "unreadable"
+    return _parse_source_job((path, source, cached_digest))
+
+def parse_pool(workers=PARSE_WORKERS):
+    """The process pool parse jobs run in, started once and kept for reuse.
+
+    Workers are spawned, not forked: parsing runs on the ingest thread of a
+    server with torch/tokenizer thread pools and batcher threads, and
+    forking a process in that state can deadlock the child. A spawned
+    worker re-imports the main module, so the pool outlives each parse
+    instead of paying that again on every ingest.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
 
-def parse_codebase(directory):
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+
+def _ping(_):
+    return os.getpid()
+
+def start_parse_pool(workers=PARSE_WORKERS):
+    """Start the pool's worker processes now (e.g. at server startup)."""
+    if workers > 1:
+        list(parse_pool(workers).map(_ping, range(workers)))
+
+def _cached_digest(previous, path):
+    entry = previous.get(path, {})
+    return entry.get('sha256') if entry.get('version') == RECORD_VERSION else None
+
+def _run_parse_jobs(worker, jobs, count, manifest, workers):
+    """Run parse jobs (in a process pool for big trees) and merge in path order.
+
+    ``jobs`` are (path, ...) tuples the worker takes minus the trailing
+    cached hash, which is looked up here. They may come from a generator;
+    with a pool, files start parsing while later jobs are still produced.
+    """
+    previous = dict(manifest) if manifest else {}
+    if manifest is not None:
+        manifest.clear()
+    jobs = ((*job, _cached_digest(previous, job[0])) for job in jobs)
+    workers = workers or PARSE_WORKERS
+
+    if workers > 1 and count >= PARALLEL_MIN_FILES:
+        print(f"⚙️ Parsing {count} files with {workers} worker processes")
+        chunksize = max(1, count // (workers * 4))
+        pool = parse_pool(workers)
+        try:
+            results = list(pool.map(worker, jobs, chunksize=chunksize))
+        except BrokenProcessPool:
+            # a worker died (e.g. killed for memory): start a fresh pool next time
+            _discard_pool(pool)
+            raise
+    else:
+        results = [worker(job) for job in jobs]
+    results.sort(key=lambda result: result[0])
+
+    file_records = {}
+    reused = 0
+    for path, digest, parsed, error in results:
+        if error:
+            print(f"⚠️ Error parsing {path}: {error}")
+            continue
+        if parsed is None:
+            records, imports = previous[path]['records'], previous[path]['imports']
+            reused += 1
+        else:
+            records, imports = parsed
+            print(f"\n📄 Parsed: {path}")
+        file_records[path] = records
+        if manifest is not None:
+            manifest[path] = {'sha256': digest, 'version': RECORD_VERSION, 'records': records, 'imports': imports}
+
+    if reused:
+        print(f"\n♻️ {reused} unchanged files reused from {FILE_MANIFEST}")
+    return file_records
+
+def parse_python_files_in_directory(directory, manifest=None, workers=PARSE_WORKERS, recursive=True):
+    """Parse every .py file once; returns {file_path: [records]} in path order.
+
+    If a previous file manifest is given, files whose content hash is
+    unchanged reuse their cached records instead of being parsed again.
+    The manifest is updated in place to describe the current tree,
+    including each file's import table (see file_imports).
+
+    With more than one worker (and enough files) files are fanned out to a
+    process pool; results are merged in sorted path order, so the output
+    does not depend on which worker finishes first.
+    """
+    print("🚀 Extracting functions...")
+    paths = list_python_files(directory, recursive)
+    return _run_parse_jobs(_parse_file_job, ((path,) for path in paths), len(paths), manifest, workers)
+
+def parse_python_sources(sources, count, manifest=None, workers=PARSE_WORKERS):
+    """Like parse_python_files_in_directory, for (path, source) pairs.
+
+    ``sources`` can be a generator (e.g. reading members out of a zip);
+    ``count`` is how many it will yield, used to decide on the pool.
+    """
+    print("🚀 Extracting functions...")
+    return _run_parse_jobs(_parse_source_job, sources, count, manifest, workers)
+
+def save_parse(file_records, manifest, artifact_dir="."):
+    """Write the function store + file manifest; returns the store's content hash."""
+    functions = [to_parsed_function(r) for records in file_records.values() for r in records]
+    print(f"\n✅ Extraction complete. {len(functions)} functions found.")
+
+    content_hash = write_function_store(functions, os.path.join(artifact_dir, STORE_META_FILE),
+                                        os.path.join(artifact_dir, STORE_DATA_FILE))
+
+    print(f"📦 Functions saved to {STORE_META_FILE} + {STORE_DATA_FILE} (store {content_hash[:16]})")
+
+    write_json_atomically(os.path.join(artifact_dir, FILE_MANIFEST), manifest)
+    return content_hash
+
+def parse_codebase(directory, workers=PARSE_WORKERS, artifact_dir="."):
     """
     Master function to call from main.py to parse and save functions.
+
+    Returns the per-file records so callers (e.g. build_modules_json) can
+    reuse this single parse instead of walking the tree again.
     """
     if not os.path.isdir(directory):
         raise ValueError("❌ Invalid directory path.")
 
-    print("🚀 Extracting functions...\n")
-    functions = parse_python_files_in_directory(directory)
-    print(f"\n✅ Extraction complete. {len(functions)} functions found.")
+    manifest = load_file_manifest(os.path.join(artifact_dir, FILE_MANIFEST))
+    file_records = parse_python_files_in_directory(directory, manifest, workers)
+    save_parse(file_records, manifest, artifact_dir)
+    return file_records
 
-    with open("parsed_functions.json", 'w', encoding='utf-8') as f:
-        json.dump(functions, f, indent=2)
+def parse_sources(sources, count, workers=PARSE_WORKERS, artifact_dir="."):
+    """parse_codebase for (path, source) pairs that never touch the disk.
 
-    print("📦 Functions saved to parsed_functions.json")
+    Nothing is written: returns (file_records, manifest) for save_parse(),
+    so the caller can publish the store together with the artifacts that
+    index into it.
+    """
+    manifest = load_file_manifest(os.path.join(artifact_dir, FILE_MANIFEST))
+    return parse_python_sources(sources, count, manifest, workers), manifest
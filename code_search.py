@@ -1,36 +1,283 @@
+import os
 import json
+import threading
+from collections import OrderedDict
+
 import faiss
 import numpy as np
 from sentence_transformers import SentenceTransformer
+from name_index import NameIndex, NAME_INDEX_FILE
+from bm25_index import BM25Index, BM25_INDEX_FILE
+from function_store import load_function_store
+from embed_functions import EMBEDDINGS_FILE, model_encode
+from micro_batcher import MicroBatcher, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
 
 # Load all models and data
 def load_all():
     model = SentenceTransformer("microsoft/codebert-base")
-    index = faiss.read_index("code_embeddings.index")
     with open("code_metadata.json", "r", encoding="utf-8") as f:
         metadata = json.load(f)
-    with open("parsed_functions.json", "r", encoding="utf-8") as f:
-        function_data = json.load(f)
+    index = load_faiss_index("code_embeddings.index", index_info(metadata))
+    function_data = load_function_store()
     return model, index, metadata, function_data
 
-def find_top_functions(question, model, index, function_data, k=3):
-    lower_question = question.lower()
-    name_matches = [
-        i for i, func in enumerate(function_data)
-        if any(word in func['function_name'].lower() for word in lower_question.split())
+# Reciprocal-rank fusion constant; larger values flatten the rank curve
+RRF_K = 60
+
+# Candidates pulled from each retriever per requested hit
+CANDIDATE_FACTOR = 4
+
+# Search-time overrides for ANN indexes; None keeps the values recorded
+# in code_metadata.json when the index was built
+SEARCH_NPROBE    = None
+SEARCH_EF_SEARCH = None
+
+def index_info(metadata):
+    # code_metadata.json was a bare list before the backend was recorded
+    if isinstance(metadata, dict):
+        return metadata.get("index", {})
+    return {"backend": "flat-l2"}
+
+def configure_index(index, info):
+    """Apply nprobe / efSearch to a freshly loaded IVF or HNSW index."""
+    backend = info.get("backend")
+    if backend == "ivf":
+        faiss.extract_index_ivf(index).nprobe = SEARCH_NPROBE or info.get("nprobe", 1)
+    elif backend == "hnsw":
+        faiss.downcast_index(index).hnsw.efSearch = SEARCH_EF_SEARCH or info.get("ef_search", 16)
+    return index
+
+# "mmap" maps the vectors (flat indexes, IVF lists) instead of copying them
+# into each process, so several web workers share one page-cached copy;
+# "memory" reads it all in
+INDEX_LOAD_MODE = "mmap"
+
+class MmapFlatIndex:
+    """Exact cosine search directly over the mmapped embedding matrix.
+
+    Stands in for faiss.IndexFlatIP (same search() contract) without
+    loading the vectors: opening it is O(1) whatever the repo size, and
+    the pages are shared between every process that maps the file.
+    """
+
+    metric_type = faiss.METRIC_INNER_PRODUCT
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.ntotal = len(embeddings)
+
+    @classmethod
+    def load(cls, path=EMBEDDINGS_FILE):
+        return cls(np.load(path, mmap_mode="r"))
+
+    def search(self, queries, k):
+        n = len(queries)
+        distances = np.full((n, k), -np.inf, dtype="float32")
+        labels = np.full((n, k), -1, dtype="int64")
+        top = min(k, self.ntotal)
+        if not top:
+            return distances, labels
+        scores = np.asarray(queries, dtype="float32") @ self.embeddings.T
+        for row, row_scores in enumerate(scores):
+            best = np.argpartition(-row_scores, top - 1)[:top]
+            best = best[np.argsort(-row_scores[best], kind="stable")]
+            labels[row, :top] = best
+            distances[row, :top] = row_scores[best]
+        return distances, labels
+
+def load_faiss_index(path, info, mode=None, embeddings_path=EMBEDDINGS_FILE):
+    """Load the search index for the backend described by info.
+
+    In mmap mode a flat index is served by MmapFlatIndex over the saved
+    embedding matrix, and IVF/HNSW indexes are opened with IO_FLAG_MMAP
+    (falling back to a normal read where this faiss build can't map them).
+    IO_FLAG_MMAP only maps an IVF index's inverted lists (the coarse
+    quantizer is still read); an HNSW index's graph and vectors are read
+    into memory whatever the mode, so every process holds its own copy.
+    """
+    mode = mode or INDEX_LOAD_MODE
+    if mode == "mmap":
+        if info.get("backend") == "flat" and os.path.exists(embeddings_path):
+            return MmapFlatIndex.load(embeddings_path)
+        if info.get("backend") == "hnsw":
+            print(f"⚠️ HNSW indexes can't be memory-mapped; {path} is read into this process's memory")
+        try:
+            index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            return configure_index(index, info)
+        except RuntimeError as e:
+            print(f"⚠️ Could not mmap {path} ({e}); loading it into memory")
+    return configure_index(faiss.read_index(path), info)
+
+def load_sparse_index(cls, path, function_data):
+    # built at ingest time; older artifact sets get one built in memory
+    try:
+        return cls.load(path)
+    except (OSError, ValueError, KeyError):
+        return cls.build(function_data)
+
+def load_name_index(function_data, path=NAME_INDEX_FILE):
+    return load_sparse_index(NameIndex, path, function_data)
+
+def load_bm25_index(function_data, path=BM25_INDEX_FILE):
+    return load_sparse_index(BM25Index, path, function_data)
+
+def encode_queries(model, questions):
+    """Normalised float32 query embeddings, shape (len(questions), dim)."""
+    query_embeddings = np.array(model_encode(model, list(questions))).astype("float32")
+    # corpus vectors are L2-normalised at ingest; the query must match
+    faiss.normalize_L2(query_embeddings)
+    return query_embeddings
+
+def encode_query(model, question):
+    """Normalised float32 query embedding, shape (1, dim)."""
+    return encode_queries(model, [question])
+
+# Query embeddings remembered by QueryEncoder
+QUERY_CACHE_SIZE = 2048
+
+class QueryEncoder:
+    """Bounded LRU cache of query embeddings in front of the model.
+
+    Keyed by the exact question text and safe to share between request
+    threads. encode() embeds all uncached questions of a batch in a single
+    forward pass; encode_one() calls from concurrent requests are
+    micro-batched into such a pass.
+    """
+
+    def __init__(self, model, max_entries=QUERY_CACHE_SIZE, batch_size=BATCH_MAX_SIZE,
+                 batch_wait_ms=BATCH_MAX_WAIT_MS):
+        self.model = model
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.batcher = MicroBatcher(self.encode, batch_size, batch_wait_ms)
+
+    def encode(self, questions):
+        """Normalised embeddings for a batch of questions, shape (n, dim)."""
+        vectors = {}
+        with self._lock:
+            for question in questions:
+                vector = self._cache.get(question)
+                if vector is not None:
+                    self._cache.move_to_end(question)
+                    vectors[question] = vector
+        missing = [q for q in dict.fromkeys(questions) if q not in vectors]
+        if missing:
+            for question, vector in zip(missing, encode_queries(self.model, missing)):
+                vectors[question] = vector
+            with self._lock:
+                for question in missing:
+                    self._cache[question] = vectors[question]
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        with self._lock:
+            self.hits += len(questions) - len(missing)
+            self.misses += len(missing)
+        return np.stack([vectors[q] for q in questions])
+
+    def encode_one(self, question):
+        """Normalised embedding for one question, shape (1, dim)."""
+        with self._lock:
+            vector = self._cache.get(question)
+            if vector is not None:
+                # cached: no reason to wait for a batch
+                self._cache.move_to_end(question)
+                self.hits += 1
+                return vector[None]
+        return self.batcher(question)[None]
+
+    def stats(self):
+        return {"entries": len(self._cache), "hits": self.hits, "misses": self.misses,
+                "batching": self.batcher.stats()}
+
+def dense_candidates(index, query_embeddings, candidates):
+    """[(function index, score)] best first for each row of query_embeddings.
+
+    One index.search call for the whole batch; scores are higher-is-better
+    as in search_functions().
+    """
+    distances, indices = index.search(query_embeddings, candidates)
+    sign = 1.0 if index.metric_type == faiss.METRIC_INNER_PRODUCT else -1.0
+    return [
+        [(int(i), sign * float(d)) for i, d in zip(row_indices, row_distances) if i >= 0]
+        for row_indices, row_distances in zip(indices, distances)
     ]
 
-    query_embedding = model.encode([question])
-    query_embedding = np.array(query_embedding).astype("float32")
-    _, semantic_indices = index.search(query_embedding, k * 2)
+def search_functions(question, model, index, function_data, k=3, name_index=None, bm25_index=None,
+                     query_embedding=None, dense=None):
+    """Hybrid retrieval: name index + BM25 + dense vectors, fused by RRF.
+
+    Returns up to k hits, best first, as dicts with the fused ``score`` and
+    each retriever's own score (``name``, ``bm25``, ``dense``; None when
+    that retriever did not return the function). ``dense`` is the cosine
+    similarity (negated distance on legacy L2 indexes), so higher is better
+    for every score. Pass ``query_embedding`` (from encode_query) to skip
+    encoding the question again, or ``dense`` (a dense_candidates() row of
+    at least k * CANDIDATE_FACTOR) to skip the vector search too.
+    """
+    if name_index is None:
+        name_index = NameIndex.build(function_data)
+    if bm25_index is None:
+        bm25_index = BM25Index.build(function_data)
+    candidates = k * CANDIDATE_FACTOR
+
+    if dense is None:
+        if query_embedding is None:
+            query_embedding = encode_query(model, question)
+        dense = dense_candidates(index, query_embedding, candidates)[0]
+    dense = dense[:candidates]
+
+    hits = {}
+    for source, ranked in (
+        ("name", name_index.search(question, limit=candidates)),
+        ("bm25", bm25_index.search(question, limit=candidates)),
+        ("dense", dense),
+    ):
+        for rank, (idx, score) in enumerate(ranked):
+            hit = hits.setdefault(idx, {"index": idx, "score": 0.0, "name": None, "bm25": None, "dense": None})
+            hit[source] = score
+            hit["score"] += 1.0 / (RRF_K + rank + 1)
+
+    return sorted(hits.values(), key=lambda h: (-h["score"], h["index"]))[:k]
+
+# Call-graph expansion: extra neighbours of the hits added per query (off
+# unless asked for), how many calls away they may be, and how much each
+# call of distance discounts a neighbour's similarity
+EXPANSION_LIMIT = 0
+EXPANSION_DEPTH = 2
+EXPANSION_DECAY = 0.8
 
-    combined = name_matches + list(semantic_indices[0])
-    unique_top_k = []
-    for idx in combined:
-        if idx not in unique_top_k:
-            unique_top_k.append(idx)
-        if len(unique_top_k) == k:
-            break
+def expand_hits(hits, adjacency, query_embedding, embeddings=None, limit=EXPANSION_LIMIT,
+                depth=EXPANSION_DEPTH):
+    """Neighbours of the hits in the call graph, best first.
 
-    return unique_top_k
+    Follows the precomputed callees of each hit up to ``depth`` calls away
+    and ranks what it finds by cosine similarity to the query, discounted
+    by EXPANSION_DECAY per call of distance (similarity is 0 without the
+    embedding matrix, so the nearest calls win). Returned hits look like
+    search_functions() hits, but are labelled ``"via": "call_graph"`` and
+    carry that ranking as ``graph_score`` (``score`` is None: it is on the
+    fused-rank scale of the retrieved hits), along with ``via_index`` (the
+    store index of the hit they were reached from) and ``distance``.
+    """
+    found = adjacency.neighbours([hit["index"] for hit in hits], depth)
+    if not found or limit <= 0:
+        return []
+    indices = sorted(found)
+    similarity = [None] * len(indices)
+    if embeddings is not None and len(embeddings) > indices[-1]:
+        similarity = (np.asarray(embeddings[indices], dtype="float32") @ np.ravel(query_embedding)).tolist()
+    ranked = sorted(
+        ({"index": i, "score": None, "name": None, "bm25": None, "dense": sim,
+          "graph_score": (sim or 0.0) * EXPANSION_DECAY ** (found[i][0] - 1),
+          "via": "call_graph", "via_index": found[i][1], "distance": found[i][0]}
+         for i, sim in zip(indices, similarity)),
+        key=lambda h: (-h["graph_score"], h["distance"], h["index"]),
+    )
+    return ranked[:limit]
 
+def find_top_functions(question, model, index, function_data, k=3, name_index=None, bm25_index=None):
+    hits = search_functions(question, model, index, function_data, k, name_index, bm25_index)
+    return [hit["index"] for hit in hits]
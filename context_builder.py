@@ -0,0 +1,149 @@
+import math
+
+from bm25_index import tokenize_code
+
+# Prompt budget for the retrieved code, in (estimated) tokens. Prefill time
+# grows with prompt length, so this bounds the per-answer latency
+CONTEXT_TOKEN_BUDGET = 1536
+
+# Rough characters per token for code with llama-style tokenizers; we have
+# no tokenizer at hand, and an estimate is enough to bound the prompt
+CHARS_PER_TOKEN = 3.5
+
+# Hits ranked below this are rendered as signature + docstring only
+FULL_CODE_HITS = 2
+
+# Lines kept around each relevant line when a function has to be cut
+SNIPPET_CONTEXT_LINES = 3
+
+# Longest signature kept (multi-line defs) and docstring shown for compact hits
+MAX_SIGNATURE_LINES = 6
+COMPACT_DOC_CHARS   = 240
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _signature_length(lines):
+    """Number of leading lines that make up the def (decorators included)."""
+    for i, line in enumerate(lines[:MAX_SIGNATURE_LINES]):
+        if not line.lstrip().startswith("@") and line.rstrip().endswith(":"):
+            return i + 1
+    return 1 if lines else 0
+
+
+def compact_rendering(func):
+    """'def name(args)' plus the start of the docstring."""
+    args = ", ".join(func.get("args") or [])
+    text = f"def {func.get('qualified_name') or func['function_name']}({args})"
+    doc = (func.get("docstring") or "").strip()
+    if doc:
+        doc = " ".join(doc.split())
+        if len(doc) > COMPACT_DOC_CHARS:
+            doc = doc[:COMPACT_DOC_CHARS].rsplit(" ", 1)[0] + " …"
+        text += f'\n    """{doc}"""'
+    return text
+
+
+def _select_lines(lines, available, question_tokens, max_tokens):
+    """Offsets of the lines to show: signature first, then the most relevant windows."""
+    costs = [estimate_tokens(line + "\n") for line in lines]
+    if sum(costs[i] for i in available) <= max_tokens:
+        return sorted(available)
+
+    chosen, used = set(), 0
+
+    def take(offsets):
+        nonlocal used
+        for i in offsets:
+            if i in available and i not in chosen:
+                if used + costs[i] > max_tokens:
+                    return False
+                chosen.add(i)
+                used += costs[i]
+        return True
+
+    take(range(_signature_length(lines)))
+    scores = {
+        i: len(question_tokens.intersection(tokenize_code(lines[i])))
+        for i in available
+    }
+    # most relevant lines first; unscored code falls back to reading order
+    for i in sorted(available, key=lambda i: (-scores[i], i)):
+        if not take(range(max(0, i - SNIPPET_CONTEXT_LINES), i + SNIPPET_CONTEXT_LINES + 1)):
+            break
+    return sorted(chosen)
+
+
+def _render_lines(lines, offsets):
+    out, previous = [], -1
+    for i in offsets:
+        if i > previous + 1:
+            indent = lines[i][:len(lines[i]) - len(lines[i].lstrip())]
+            out.append(f"{indent}# … {i - previous - 1} lines omitted")
+        out.append(lines[i])
+        previous = i
+    if offsets and previous < len(lines) - 1:
+        out.append(f"    # … {len(lines) - 1 - previous} lines omitted")
+    return "\n".join(out)
+
+
+def build_context(question, functions, budget=CONTEXT_TOKEN_BUDGET):
+    """Pack ranked functions into a code context of at most ~budget tokens.
+
+    The top FULL_CODE_HITS hits get their code, cut down to the lines most
+    relevant to the question when they don't fit their share of the budget;
+    lower-ranked hits get a signature + docstring. Code already shown for
+    a higher-ranked hit (same file and lines, e.g. a nested function, or an
+    identical body) is not repeated. Returns (text, report).
+    """
+    question_tokens = set(tokenize_code(question))
+    compact = [compact_rendering(func) for func in functions]
+    shown_lines = {}   # file -> set of line numbers already in the context
+    shown_code = {}    # code -> rank that showed it
+    blocks = []
+    report = {"budget": budget, "truncated": 0, "compact": 0, "deduplicated": 0}
+    used = 0
+
+    for rank, func in enumerate(functions):
+        header = f"\n#{rank + 1} — From {func['file']}:"
+        code = func.get("code") or ""
+        lines = code.splitlines()
+        start = func.get("line_number")
+        seen = shown_lines.setdefault(func["file"], set())
+        available = [i for i in range(len(lines)) if start is None or start + i not in seen]
+
+        if code in shown_code or (lines and not available):
+            earlier = shown_code.get(code)
+            block = f"{header} {func['function_name']} (code shown above{f' in #{earlier}' if earlier else ''})"
+            report["deduplicated"] += 1
+        else:
+            # leave room for the compact rendering of every hit after this one
+            reserve = sum(estimate_tokens(c) + 12 for c in compact[rank + 1:])
+            full_left = max(1, len({f.get("code") for f in functions[rank:FULL_CODE_HITS]
+                                    if f.get("code") not in shown_code}))
+            share = (budget - used - reserve) // full_left
+            if rank < FULL_CODE_HITS and share >= estimate_tokens(compact[rank]):
+                offsets = _select_lines(lines, available, question_tokens, share)
+                if len(offsets) < len(lines):
+                    report["truncated"] += 1
+                body = _render_lines(lines, offsets)
+                if start is not None:
+                    seen.update(start + i for i in offsets)
+            else:
+                body = compact[rank]
+                report["compact"] += 1
+            block = f"{header}\n```python\n{body}\n```"
+            shown_code[code] = rank + 1
+
+        cost = estimate_tokens(block)
+        if used + cost > budget and blocks:
+            # out of budget even for compact hits: drop the tail
+            break
+        blocks.append(block)
+        used += cost
+
+    report["included"] = len(blocks)
+    report["tokens"] = used
+    return "\n".join(blocks) + "\n", report
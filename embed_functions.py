@@ -1,87 +1,297 @@
 import os
 import json
+import time
+import hashlib
+import argparse
+import threading
 import numpy as np
 import gc  # Garbage collection
 from sentence_transformers import SentenceTransformer
 import faiss
 
+from name_index import NameIndex, NAME_INDEX_FILE
+from bm25_index import BM25Index, BM25_INDEX_FILE
+from function_store import load_function_store, write_atomically, write_json_atomically, publish_artifacts
+
+EMBEDDINGS_FILE = "code_embeddings.npy"
+INDEX_MANIFEST  = "index_manifest.json"
+
+# Functions per forward pass; raise on machines with more RAM / a GPU
+EMBED_BATCH_SIZE = 16
+
+# FAISS backend: "flat" (exact cosine), "ivf", "hnsw", or "auto", which
+# switches from flat to IVF once a repo has AUTO_ANN_THRESHOLD functions.
+# All backends use inner product over L2-normalised vectors (= cosine).
+INDEX_BACKEND      = "auto"
+AUTO_ANN_THRESHOLD = 50000
+IVF_TRAIN_PER_LIST = 64     # training vectors sampled per inverted list
+IVF_NPROBE         = 16     # lists scanned per query
+HNSW_M             = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH     = 64
+
+# A rebuild reuses the previous ANN index instead of starting over: rows
+# appended at the end are just added, and IVF keeps its trained centroids
+# (refilling the lists, no k-means) until this share of rows has changed
+# since training or nlist drifts 2x from its target for the repo size
+IVF_RETRAIN_FRACTION = 0.25
+
 # Global variable to store the model
 _model = None
+_model_load_lock = threading.Lock()
+
+# The fast tokenizer behind model.encode keeps per-call truncation/padding
+# state and raises "Already borrowed" when used from two threads at once
+# (ingest embedding while /chat encodes queries), so every encode holds this
+MODEL_LOCK = threading.Lock()
 
 def get_model():
     global _model
-    if _model is None:
-        print("📥 Loading CodeBERT embedding model...")
-        # Set environment variables to limit memory usage
-        os.environ["TOKENIZERS_PARALLELISM"] = "false"
-        _model = SentenceTransformer("microsoft/codebert-base")
+    with _model_load_lock:
+        if _model is None:
+            print("📥 Loading CodeBERT embedding model...")
+            # Set environment variables to limit memory usage
+            os.environ["TOKENIZERS_PARALLELISM"] = "false"
+            _model = SentenceTransformer("microsoft/codebert-base")
     return _model
 
-def embed_parsed_functions():
-    # Load functions from JSON
-    with open("parsed_functions.json", "r", encoding="utf-8") as f:
-        functions = json.load(f)
-    
-    if not functions:
-        print("⚠️ No functions found to embed.")
-        return
-    
-    # Get text representations to encode
-    function_texts = []
-    for func in functions:
-        # Include function name, signature and docstring in embedding
-        signature = f"{func['function_name']}({', '.join(func['args'])})"
-        docstring = func['docstring'] if func['docstring'] else ""
-        function_texts.append(f"{signature}\n{docstring}\n{func['code']}")
-    
+def model_encode(model, texts, **kwargs):
+    """model.encode under MODEL_LOCK."""
+    with MODEL_LOCK:
+        return model.encode(texts, **kwargs)
+
+def function_text(func):
+    # Include function name, signature and docstring in embedding
+    signature = f"{func['function_name']}({', '.join(func['args'])})"
+    docstring = func['docstring'] if func['docstring'] else ""
+    return f"{signature}\n{docstring}\n{func['code']}"
+
+def encode_texts(texts, batch_size=EMBED_BATCH_SIZE):
+    """Encode texts in a single pass into a preallocated float32 array.
+
+    Texts are batched in order of length so each batch pads to a similar
+    size; rows are written back to their original positions. Returns the
+    array and a throughput report.
+    """
+    model = get_model()
+    embeddings = np.empty((len(texts), model.get_sentence_embedding_dimension()), dtype='float32')
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+
+    start = time.perf_counter()
+    for offset in range(0, len(order), batch_size):
+        rows = order[offset:offset + batch_size]
+        # locked per batch, so a query waits for at most one batch
+        embeddings[rows] = model_encode(
+            model,
+            [texts[i] for i in rows],
+            batch_size=len(rows),
+            show_progress_bar=False,
+            convert_to_numpy=True,
+        )
+        print(f"   {min(offset + batch_size, len(order))}/{len(order)} encoded", end="\r")
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "functions": len(texts),
+        "batch_size": batch_size,
+        "seconds": round(elapsed, 3),
+        "functions_per_sec": round(len(texts) / elapsed, 2) if elapsed else None,
+    }
+    print(f"\n⚡ Encoded {len(texts)} functions in {elapsed:.2f}s "
+          f"({report['functions_per_sec']} functions/sec, batch size {batch_size})")
+    return embeddings, report
+
+def load_previous_embeddings(artifact_dir="."):
+    """Map function content hash -> embedding row from the last build."""
+    manifest_path = os.path.join(artifact_dir, INDEX_MANIFEST)
+    embeddings_path = os.path.join(artifact_dir, EMBEDDINGS_FILE)
+    if not (os.path.exists(manifest_path) and os.path.exists(embeddings_path)):
+        return {}
     try:
-        # Get model and create embeddings
-        model = get_model()
-        
-        embeddings = model.encode(
-        function_texts,
-        batch_size=4,
-        show_progress_bar=True,
-        convert_to_numpy=True,
-    )
-        
-        # Limit batch size to avoid memory issues
-        print(f"🧠 Creating embeddings for {len(function_texts)} functions...")
-        embeddings = model.encode(function_texts, batch_size=4, show_progress_bar=True)
-        
-        # Force garbage collection before FAISS operations
-        gc.collect()
-        
-        print("📊 Creating FAISS index...")
-        # Create FAISS index - use a simpler index type
-        dimension = embeddings.shape[1]
-        
-        # Convert to float32 before any FAISS operations
-        embeddings = embeddings.astype('float32')
-        
-        # Create index
-        index = faiss.IndexFlatL2(dimension)
-        
-        # Normalize embeddings
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        embeddings = np.load(embeddings_path)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring previous embeddings: {e}")
+        return {}
+    hashes = manifest.get("functions", [])
+    if len(hashes) != len(embeddings):
+        return {}
+    return {h: embeddings[row] for row, h in enumerate(hashes)}
+
+def load_parsed_functions():
+    return list(load_function_store())
+
+def compute_embeddings(functions, batch_size=EMBED_BATCH_SIZE, artifact_dir="."):
+    """Embedding stage: normalised vectors for every function, in order.
+
+    Unchanged functions (same content hash as in the previous build) keep
+    their embedding; only new or changed ones go through the model.
+    Returns (embeddings, hashes, report).
+    """
+    function_texts = [function_text(func) for func in functions]
+    hashes = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in function_texts]
+    previous = load_previous_embeddings(artifact_dir)
+    pending = [i for i, h in enumerate(hashes) if h not in previous]
+    pending_texts = [function_texts[i] for i in pending]
+    removed = len(set(previous) - set(hashes))
+    print(f"♻️ {len(functions) - len(pending)} unchanged, {len(pending)} new/changed, {removed} removed functions")
+
+    embeddings = None
+    report = {"functions": 0, "batch_size": batch_size, "seconds": 0.0, "functions_per_sec": None}
+    if pending_texts:
+        print(f"🧠 Creating embeddings for {len(pending_texts)} functions...")
+        embeddings, report = encode_texts(pending_texts, batch_size)
+
+        # Normalize embeddings (reused rows were normalized when first built)
         print("🔄 Normalizing embeddings...")
         faiss.normalize_L2(embeddings)
-        
-        # Add to index
-        print("➕ Adding embeddings to index...")
-        index.add(embeddings)
-        
-        # Save index and metadata
-        print("💾 Saving FAISS index...")
-        faiss.write_index(index, "code_embeddings.index")
-        
-        # Clear memory
-        del embeddings
-        del index
-        gc.collect()
-        
-        # Save metadata mapping the index positions to function data
-        print("📝 Saving metadata...")
-        metadata = [
+
+    # Assemble the full matrix from reused and freshly encoded rows
+    dimension = embeddings.shape[1] if embeddings is not None else len(next(iter(previous.values())))
+    all_embeddings = np.empty((len(functions), dimension), dtype='float32')
+    for i, h in enumerate(hashes):
+        if h in previous:
+            all_embeddings[i] = previous[h]
+    if pending:
+        all_embeddings[pending] = embeddings
+
+    report["reused"] = len(functions) - len(pending)
+    return all_embeddings, hashes, report
+
+def resolve_backend(backend, count):
+    if backend == "auto":
+        return "ivf" if count >= AUTO_ANN_THRESHOLD else "flat"
+    return backend
+
+def ivf_nlist(count):
+    # ~4·sqrt(n) lists, but never fewer than 39 training points per list
+    return max(1, min(int(4 * np.sqrt(count)), count // 39))
+
+def create_index(embeddings, backend=INDEX_BACKEND):
+    """Build a cosine FAISS index over normalised embeddings.
+
+    Returns (index, info); info describes the backend and its search-time
+    parameters and is stored with the index metadata.
+    """
+    count, dimension = embeddings.shape
+    backend = resolve_backend(backend, count)
+    info = {"backend": backend, "metric": "cosine", "dimension": dimension, "count": count}
+
+    if backend == "flat":
+        index = faiss.IndexFlatIP(dimension)
+    elif backend == "ivf":
+        nlist = ivf_nlist(count)
+        quantizer = faiss.IndexFlatIP(dimension)
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+        sample_size = min(count, nlist * IVF_TRAIN_PER_LIST)
+        sample = np.random.default_rng(0).choice(count, sample_size, replace=False)
+        print(f"🎓 Training IVF index ({nlist} lists) on {sample_size} vectors...")
+        index.train(embeddings[np.sort(sample)])
+        index.nprobe = min(IVF_NPROBE, nlist)
+        info.update(nlist=nlist, nprobe=index.nprobe)
+    elif backend == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        info.update(m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, ef_search=HNSW_EF_SEARCH)
+    else:
+        raise ValueError(f"Unknown index backend: {backend}")
+
+    # Add to index
+    print("➕ Adding embeddings to index...")
+    index.add(embeddings)
+    return index, info
+
+def _previous_index(artifact_dir):
+    """(index, manifest) of the last build, or (None, {}) if unusable."""
+    manifest_path = os.path.join(artifact_dir, INDEX_MANIFEST)
+    index_path = os.path.join(artifact_dir, "code_embeddings.index")
+    if not (os.path.exists(manifest_path) and os.path.exists(index_path)):
+        return None, {}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        index = faiss.read_index(index_path)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"⚠️ Ignoring previous index: {e}")
+        return None, {}
+    if index.ntotal != len(manifest.get("functions", [])):
+        return None, {}
+    return index, manifest
+
+def update_index(embeddings, hashes, backend=INDEX_BACKEND, artifact_dir="."):
+    """Index for this build, reusing the previous one where it stays valid.
+
+    Index ids are row positions, which shift whenever a file is added or
+    removed before others, so changed rows can't be swapped in place by id.
+    Instead: if the old rows are an unchanged prefix, only the new rows are
+    added (any backend); otherwise an IVF index keeps its trained centroids
+    and only refills its lists. Everything else (or a different backend,
+    dimension, or too much drift) is built from scratch by create_index.
+    Returns (index, info, stale), stale = rows changed since IVF training.
+    """
+    count, dimension = embeddings.shape
+    backend = resolve_backend(backend, count)
+    previous, manifest = _previous_index(artifact_dir)
+    info = dict(manifest.get("index", {}), count=count)
+    if previous is not None and info.get("backend") == backend and manifest.get("dimension") == dimension:
+        old_hashes = manifest["functions"]
+        stale = manifest.get("stale", 0) + len(set(hashes) - set(old_hashes))
+        appended = hashes[:len(old_hashes)] == old_hashes
+        if backend == "ivf":
+            target = ivf_nlist(count)
+            if not (target / 2 <= info.get("nlist", 0) <= target * 2 and stale <= IVF_RETRAIN_FRACTION * count):
+                appended = False
+                previous = None
+        if previous is not None and appended:
+            print(f"➕ Adding {count - len(old_hashes)} new rows to the previous index...")
+            if count > len(old_hashes):
+                previous.add(embeddings[len(old_hashes):])
+            return previous, info, stale
+        if previous is not None and backend == "ivf":
+            print(f"♻️ Reusing IVF centroids ({info['nlist']} lists), refilling lists...")
+            previous.reset()
+            previous.add(embeddings)
+            return previous, info, stale
+    index, info = create_index(embeddings, backend)
+    return index, info, 0
+
+def build_index(functions, embeddings, hashes, backend=INDEX_BACKEND, artifact_dir="."):
+    """Index stage: write the FAISS index, raw vectors, manifest and metadata."""
+    def path(name):
+        return os.path.join(artifact_dir, name)
+
+    # Force garbage collection before FAISS operations
+    gc.collect()
+
+    print("📊 Creating FAISS index...")
+    # Adding the cached vectors is a plain copy; only pending rows cost
+    # model time
+    dimension = embeddings.shape[1]
+    index, index_info, stale = update_index(embeddings, hashes, backend, artifact_dir)
+    print(f"🗂️ Index backend: {index_info['backend']}")
+
+    # Save index, raw vectors and the per-row hash manifest
+    print("💾 Saving FAISS index...")
+    # written via rename: serving processes may have these files mmapped
+    def save_vectors(tmp):
+        with open(tmp, "wb") as f:
+            np.save(f, embeddings)
+    write_atomically(path(EMBEDDINGS_FILE), save_vectors)
+    write_atomically(path("code_embeddings.index"), lambda tmp, index=index: faiss.write_index(index, tmp))
+    write_json_atomically(path(INDEX_MANIFEST),
+                          {"dimension": dimension, "functions": hashes, "index": index_info, "stale": stale})
+
+    # Clear memory
+    del index
+    gc.collect()
+
+    # Save metadata mapping the index positions to function data
+    print("📝 Saving metadata...")
+    metadata = {
+        "index": index_info,
+        "functions": [
             {
                 "index": i,
                 "function_name": func["function_name"],
@@ -89,11 +299,31 @@ def embed_parsed_functions():
             }
             for i, func in enumerate(functions)
         ]
-        
-        with open("code_metadata.json", "w", encoding="utf-8") as f:
-            json.dump(metadata, f, indent=2)
-        
+    }
+
+    write_json_atomically(path("code_metadata.json"), metadata, indent=2)
+
+    # Sparse indexes for the lexical half of retrieval
+    print("🔤 Building name index...")
+    NameIndex.build(functions).save(path(NAME_INDEX_FILE))
+    print("🔎 Building BM25 index...")
+    BM25Index.build(functions).save(path(BM25_INDEX_FILE))
+
+def embed_parsed_functions(batch_size=EMBED_BATCH_SIZE, backend=INDEX_BACKEND):
+    # Load functions from JSON
+    functions = load_parsed_functions()
+    
+    if not functions:
+        print("⚠️ No functions found to embed.")
+        return
+    
+    try:
+        embeddings, hashes, report = compute_embeddings(functions, batch_size)
+        build_index(functions, embeddings, hashes, backend)
+        # store (from code_parser) and index now match: let engines load them
+        publish_artifacts()
         print("✅ Embeddings created and saved.")
+        return report
     except Exception as e:
         print(f"❌ Error creating embeddings: {str(e)}")
         # Print the full error traceback for debugging
@@ -102,4 +332,8 @@ def embed_parsed_functions():
 
 # Optional: Run standalone
 if __name__ == "__main__":
-    embed_parsed_functions()
+    parser = argparse.ArgumentParser(description='Embed the parsed function store into a FAISS index')
+    parser.add_argument('-b', '--batch-size', type=int, default=EMBED_BATCH_SIZE, help='Functions per forward pass')
+    parser.add_argument('--backend', choices=['auto', 'flat', 'ivf', 'hnsw'], default=INDEX_BACKEND, help='FAISS index type')
+    args = parser.parse_args()
+    embed_parsed_functions(args.batch_size, args.backend)
@@ -2,24 +2,49 @@ import ast
 import os
 import argparse
 import json
+import gzip
 from typing import Dict, List, Set, Optional, Tuple
 
+from call_graph import build_call_graph, node_id
+
 
 class FunctionVisitor(ast.NodeVisitor):
     """AST visitor that extracts function definitions and their calls."""
     
     def __init__(self):
-        self.functions = {}  # name -> FunctionInfo
+        self.functions = {}  # (qualified name, line) -> FunctionInfo
+        self.imports = {}    # local name -> dotted target ('.x' = relative import)
+        self.scope = []      # enclosing class / function names
         self.current_function = None
         self.current_class = None
         
+    def visit_Import(self, node):
+        """Record names bound by ``import a.b`` / ``import a.b as c``."""
+        for alias in node.names:
+            if alias.asname:
+                self.imports[alias.asname] = alias.name
+            else:
+                head = alias.name.split('.')[0]
+                self.imports[head] = head
+
+    def visit_ImportFrom(self, node):
+        """Record names bound by ``from pkg import name`` (incl. relative)."""
+        base = '.' * node.level + (node.module or '')
+        for alias in node.names:
+            if alias.name == '*':
+                continue
+            target = f"{base}.{alias.name}" if node.module else f"{base}{alias.name}"
+            self.imports[alias.asname or alias.name] = target
+        
     def visit_ClassDef(self, node):
         """Process a class definition."""
         prev_class = self.current_class
-        self.current_class = node.name
+        self.current_class = '.'.join(self.scope + [node.name])
         
         # Visit all contents of the class
+        self.scope.append(node.name)
         self.generic_visit(node)
+        self.scope.pop()
         
         # Restore previous context
         self.current_class = prev_class
@@ -28,13 +53,11 @@ class FunctionVisitor(ast.NodeVisitor):
         """Process a function definition."""
         function_name = node.name
         
-        # If we're in a class, prefix with class name
-        if self.current_class:
-            qualified_name = f"{self.current_class}.{function_name}"
-        else:
-            qualified_name = function_name
+        # Prefix with the enclosing classes / functions (Class.method, deco.wrapper)
+        qualified_name = '.'.join(self.scope + [function_name])
             
-        params = [arg.arg for arg in node.args.args if arg.arg != 'self']
+        args = [arg.arg for arg in node.args.args]
+        params = [arg for arg in args if arg != 'self']
         doc_string = ast.get_docstring(node)
         
         # Get function source code
@@ -43,26 +66,31 @@ class FunctionVisitor(ast.NodeVisitor):
             source_lines.append(self.source_lines[i-1])
         function_source = ''.join(source_lines)
         
-        # Save the current function to restore after processing this one
+        # Save the current function to restore after processing this one.
+        # Keyed by line too: property setters and conditional redefinitions
+        # share a qualified name but are separate functions
         parent_function = self.current_function
-        self.current_function = qualified_name
+        self.current_function = (qualified_name, node.lineno)
         
         # Create function info
-        self.functions[qualified_name] = {
+        self.functions[self.current_function] = {
             'name': function_name,
             'qualified_name': qualified_name,
             'class': self.current_class,
+            'args': args,
             'params': params,
             'docstring': doc_string,
             'calls': set(),
             'line_number': node.lineno,
             'end_line': node.end_lineno,
-            'parent': parent_function,
+            'parent': parent_function[0] if parent_function else None,
             'source': function_source
         }
         
         # Visit the function body to find calls
+        self.scope.append(function_name)
         self.generic_visit(node)
+        self.scope.pop()
         
         # Restore parent function context
         self.current_function = parent_function
@@ -72,71 +100,266 @@ class FunctionVisitor(ast.NodeVisitor):
         if self.current_function:
             if isinstance(node.func, ast.Name):
                 # Direct function call
-                self.functions.setdefault(self.current_function, {}).setdefault('calls', set()).add(node.func.id)
+                self.functions[self.current_function]['calls'].add(node.func.id)
             elif isinstance(node.func, ast.Attribute):
                 # Method call or attribute access
                 if isinstance(node.func.value, ast.Name):
                     if node.func.value.id == 'self' and self.current_class:
                         # Self method call within class
-                        self.functions.setdefault(self.current_function, {}).setdefault('calls', set()).add(f"{self.current_class}.{node.func.attr}")
+                        self.functions[self.current_function]['calls'].add(f"{self.current_class}.{node.func.attr}")
                     else:
                         # Other attribute call
-                        self.functions.setdefault(self.current_function, {}).setdefault('calls', set()).add(f"{node.func.value.id}.{node.func.attr}")
+                        self.functions[self.current_function]['calls'].add(f"{node.func.value.id}.{node.func.attr}")
                 else:
-                    # Generic method call
-                    self.functions.setdefault(self.current_function, {}).setdefault('calls', set()).add(node.func.attr)
+                    # Dotted call through modules (pkg.utils.load) or a generic method call
+                    dotted = self._dotted_name(node.func)
+                    call = dotted if dotted and not dotted.startswith('self.') else node.func.attr
+                    self.functions[self.current_function]['calls'].add(call)
         
         # Continue visiting children
         self.generic_visit(node)
     
+    @staticmethod
+    def _dotted_name(node):
+        """'a.b.c' for a chain of plain attribute accesses, else None."""
+        parts = []
+        while isinstance(node, ast.Attribute):
+            parts.insert(0, node.attr)
+            node = node.value
+        if not isinstance(node, ast.Name):
+            return None
+        return '.'.join([node.id] + parts)
+
     def set_source(self, source_lines):
         """Set the source code lines for reference."""
         self.source_lines = source_lines
 
 
+def extract_file(file_path: str, source: str) -> Tuple[List[Dict], Dict[str, str]]:
+    """Parse a file once: (one unified record per function, the file's imports).
+
+    Each record carries everything both inventories need: signature
+    (``args``/``params``), docstring, source span, calls, class and parent.
+    ``imports`` holds the import bindings the function's calls go through,
+    so calls can be resolved later without re-reading the file. The file's
+    own import table (local name -> dotted target) is returned alongside:
+    a package ``__init__`` that only re-exports names has no records, but
+    calls through it still resolve via that table.
+    ``code_parser`` and ``ModuleAnalyzer`` are both built from these records.
+    Raises ``SyntaxError`` if the source does not parse.
+    """
+    tree = ast.parse(source)
+
+    visitor = FunctionVisitor()
+    visitor.set_source(source.splitlines(True))  # Keep line endings
+    visitor.visit(tree)
+
+    module_name = os.path.basename(file_path).replace('.py', '')
+    records = []
+    for func in visitor.functions.values():
+        record = {'file': file_path, 'module': module_name}
+        record.update(func)
+        record['calls'] = sorted(func.get('calls', ()))
+        heads = {call.split('.')[0] for call in record['calls']}
+        record['imports'] = {h: visitor.imports[h] for h in sorted(heads) if h in visitor.imports}
+        records.append(record)
+    return records, dict(sorted(visitor.imports.items()))
+
+
+def extract_file_records(file_path: str, source: str) -> List[Dict]:
+    """The per-function records of extract_file(), without the import table."""
+    return extract_file(file_path, source)[0]
+
+
+def module_name_for(file_path: str, known_paths: Optional[Set[str]] = None) -> str:
+    """Dotted import name of a file, e.g. ``pkg/sub/mod.py`` -> ``pkg.sub.mod``.
+
+    Parent directories count as packages while they contain an
+    ``__init__.py``, the same rule the import system uses. ``known_paths``
+    (the set of files being analyzed) replaces the filesystem check.
+    """
+    def is_package(directory):
+        init = os.path.join(directory, '__init__.py')
+        return init in known_paths if known_paths is not None else os.path.isfile(init)
+
+    directory, filename = os.path.split(os.path.normpath(file_path))
+    stem = filename[:-3] if filename.endswith('.py') else filename
+    parts = [] if stem == '__init__' else [stem]
+    while directory and is_package(directory):
+        directory, package = os.path.split(directory)
+        parts.insert(0, package)
+    return '.'.join(parts) or stem
+
+
+def _absolute_target(target: str, module_name: str, is_package: bool) -> str:
+    """Turn a relative import target ('.utils.load') into a dotted name."""
+    level = len(target) - len(target.lstrip('.'))
+    if not level:
+        return target
+    base = module_name.split('.')
+    if not is_package:
+        base = base[:-1]
+    base = base[:len(base) - (level - 1)] if level > 1 else base
+    rest = target[level:]
+    return '.'.join(base + ([rest] if rest else []))
+
+
 class ModuleAnalyzer:
     """Analyze Python modules for function definitions and relationships."""
     
     def __init__(self):
         self.modules = {}
+        self._by_name = None
         
     def analyze_file(self, file_path: str) -> Dict:
         """Analyze a single Python file."""
         with open(file_path, 'r', encoding='utf-8') as file:
             try:
-                code = file.read()
-                source_lines = code.splitlines(True)  # Keep line endings
-                tree = ast.parse(code)
-                
-                visitor = FunctionVisitor()
-                visitor.set_source(source_lines)
-                visitor.visit(tree)
-                
-                module_name = os.path.basename(file_path).replace('.py', '')
-                self.modules[module_name] = {
-                    'path': file_path,
-                    'functions': visitor.functions
-                }
-                
-                return visitor.functions
+                records, imports = extract_file(file_path, file.read())
+                return self.add_file_records(file_path, records, imports=imports)
             except Exception as e:
                 print(f"Error analyzing {file_path}: {e}")
                 return {}
+
+    def add_file_records(self, file_path: str, records: List[Dict],
+                         known_paths: Optional[Set[str]] = None,
+                         imports: Optional[Dict[str, str]] = None) -> Dict:
+        """Register the records extracted from one file (and its imports) as a module."""
+        module_name = module_name_for(file_path, known_paths)
+        functions = {}
+        for r in records:
+            name = r['qualified_name']
+            if name in functions:
+                # a redefinition (property setter, conditional def) gets its own
+                # node; calls by name resolve to the first definition
+                name = f"{name}@{r['line_number']}"
+            functions[name] = dict(r, module=module_name, qualified_name=name)
+        self.modules[module_name] = {
+            'path': file_path,
+            'package': os.path.basename(file_path) == '__init__.py',
+            'functions': functions,
+            'imports': imports,
+        }
+        return functions
+
+    def add_modules_data(self, modules_data: List[Dict]) -> None:
+        """Register saved modules data (modules_data.json) as modules."""
+        for module in modules_data:
+            self.modules[module['name']] = {
+                'path': module['path'],
+                'package': os.path.basename(module['path']) == '__init__.py',
+                'functions': {f['qualified_name']: dict(f, module=module['name']) for f in module['functions']},
+                'imports': module.get('imports'),
+            }
+
+    def add_file_map(self, file_records: Dict[str, List[Dict]],
+                     file_imports: Optional[Dict[str, Dict[str, str]]] = None) -> None:
+        """Register {file_path: records} (as returned by code_parser).
+
+        ``file_imports`` is {file_path: import table}, e.g. from
+        code_parser.file_imports(manifest).
+        """
+        known_paths = {os.path.normpath(p) for p in file_records}
+        file_imports = file_imports or {}
+        for file_path, records in file_records.items():
+            self.add_file_records(file_path, records, known_paths, file_imports.get(file_path))
     
-    def analyze_directory(self, directory: str, recursive: bool = True) -> None:
-        """Analyze all Python files in a directory."""
-        for root, _, files in os.walk(directory):
-            for file in files:
-                if file.endswith('.py'):
-                    file_path = os.path.join(root, file)
-                    self.analyze_file(file_path)
-                    
-            if not recursive:
-                break
+    def analyze_directory(self, directory: str, recursive: bool = True, workers: Optional[int] = 1) -> None:
+        """Analyze all Python files in a directory.
+
+        Uses the same single-pass parser as code_parser, including its
+        per-file error handling; ``workers`` > 1 parses in a process pool.
+        """
+        # imported here: code_parser itself imports extract_file
+        from code_parser import parse_python_files_in_directory, file_imports
+
+        manifest = {}
+        file_records = parse_python_files_in_directory(directory, manifest, workers=workers, recursive=recursive)
+        self.add_file_map(file_records, file_imports(manifest))
 
-    def generate_interactive_html(self, output_file: str = 'function_map.html'):
-        """Generate an interactive HTML visualization."""
-        # Prepare data structure for visualization
+    def _lookup(self, dotted: str, seen: Optional[Set[str]] = None) -> Optional[str]:
+        """Function id ('module.Qualified.name') for a dotted name, if defined here.
+
+        Module prefixes are tried longest first; a class resolves to its
+        __init__. A name a module only imports (``pkg/__init__`` doing
+        ``from .core import f``) is followed to where it is defined;
+        ``seen`` guards against import cycles.
+        """
+        seen = set() if seen is None else seen
+        if dotted in seen:
+            return None
+        seen.add(dotted)
+        parts = dotted.split('.')
+        for cut in range(len(parts) - 1, 0, -1):
+            module_name = '.'.join(parts[:cut])
+            module = self.modules.get(module_name)
+            if module is None:
+                continue
+            qualified = '.'.join(parts[cut:])
+            for name in (qualified, f"{qualified}.__init__"):
+                if name in module['functions']:
+                    return f"{module_name}.{name}"
+            target = (module.get('imports') or {}).get(parts[cut])
+            if target is not None:
+                target = _absolute_target(target, module_name, module['package'])
+                found = self._lookup('.'.join([target] + parts[cut + 1:]), seen)
+                if found is not None:
+                    return found
+        return None
+
+    def resolve_call(self, module_name: str, func: Dict, call: str) -> Optional[str]:
+        """Id of the function a recorded call refers to, or None if external."""
+        module = self.modules[module_name]
+        for name in (call, f"{call}.__init__"):
+            if name in module['functions']:
+                return f"{module_name}.{name}"
+        # modules data keeps the import table per module, not per function
+        imports = func.get('imports', module.get('imports'))
+        if imports is None:
+            # records saved before imports were kept: an already module-qualified
+            # call (utils.log) or a name defined exactly once in the tree
+            candidates = self._names().get(call, [])
+            return self._lookup(call) or (candidates[0] if len(candidates) == 1 else None)
+        head, _, rest = call.partition('.')
+        target = imports.get(head)
+        if target is None:
+            return None
+        target = _absolute_target(target, module_name, module['package'])
+        return self._lookup(f"{target}.{rest}" if rest else target)
+
+    def _names(self) -> Dict[str, List[str]]:
+        """Qualified name -> ids of the functions defining it, across modules."""
+        if self._by_name is None:
+            self._by_name = {}
+            for module_name, module in self.modules.items():
+                for name, func in module['functions'].items():
+                    self._by_name.setdefault(func['qualified_name'], []).append(f"{module_name}.{name}")
+        return self._by_name
+
+    def resolve_calls(self) -> None:
+        """Resolve every function's calls through its module's imports.
+
+        Sets ``callees`` (ids of functions defined in the analyzed tree) and
+        ``external`` (calls that leave it: builtins, libraries, unknown
+        receivers) on each function. This is the only place call edges are
+        decided; the diagram and retrieval read ``callees`` as-is.
+        """
+        self._by_name = None
+        for module_name, module in self.modules.items():
+            for func in module['functions'].values():
+                callees, external = [], []
+                for call in func.get('calls', []):
+                    target = self.resolve_call(module_name, func, call)
+                    if target is None:
+                        external.append(call)
+                    elif target not in callees:
+                        callees.append(target)
+                func['callees'] = callees
+                func['external'] = external
+
+    def _modules_data(self) -> List[Dict]:
+        """Resolved, laid-out modules data as the HTML page consumes it."""
+        self.resolve_calls()
         modules_data = []
         
         for module_name, module_info in self.modules.items():
@@ -153,18 +376,77 @@ class ModuleAnalyzer:
             
             modules_data.append(module_data)
         
-        # Generate HTML template
-        html_content = self._generate_html_template(modules_data)
+        # Lay the graph out once here instead of in the browser
+        positions = {n['id']: (n['x'], n['y']) for n in build_call_graph(modules_data)['nodes']}
+        for module_data in modules_data:
+            for func_data in module_data['functions']:
+                func_data['x'], func_data['y'] = positions[node_id(module_data['name'], func_data['qualified_name'])]
+        return modules_data
+
+    def generate_interactive_html(self, output_file: str = 'function_map.html', external: bool = False,
+                                  compress: bool = False, shard_size: Optional[int] = None):
+        """Generate an interactive HTML visualization.
+
+        By default everything, sources included, is inlined into one file.
+        With ``external`` the page is a small shell and the data goes to a
+        ``<output>_data`` directory: the graph in one file and the sources
+        in shards (one per module, or ``shard_size`` functions each) that
+        are fetched when a function is opened. ``compress`` gzips them.
+        """
+        modules_data = self._modules_data()
+        
+        if external or compress or shard_size:
+            data_config = self._write_external_data(modules_data, output_file, compress, shard_size)
+            html_content = self._generate_html_template(None, data_config)
+        else:
+            html_content = self._generate_html_template(modules_data)
         
         # Write HTML file
         with open(output_file, 'w', encoding='utf-8') as f:
             f.write(html_content)
             
         print(f"Interactive visualization saved to {output_file}")
+
+    def _write_external_data(self, modules_data: List[Dict], output_file: str,
+                             compress: bool, shard_size: Optional[int]) -> Dict:
+        """Write the graph + source shards next to output_file; returns the page's data config."""
+        data_dir = f"{os.path.splitext(output_file)[0]}_data"
+        os.makedirs(data_dir, exist_ok=True)
+        ext = '.json.gz' if compress else '.js'
+
+        def write(name, payload):
+            path = os.path.join(data_dir, name + ext)
+            if compress:
+                # fetched + decompressed by the page, so it must be served over http(s)
+                with gzip.open(path, 'wt', encoding='utf-8') as f:
+                    json.dump(payload, f, separators=(',', ':'))
+            else:
+                # loaded through a <script> tag, which also works from file://
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(f"FunctionMapData.receive({json.dumps(name)}, ")
+                    json.dump(payload, f, separators=(',', ':'))
+                    f.write(");\n")
+
+        shards = []
+        for module_data in modules_data:
+            if not shard_size and module_data['functions']:
+                shards.append({})
+            for func_data in module_data['functions']:
+                if shard_size and (not shards or len(shards[-1]) >= shard_size):
+                    shards.append({})
+                shards[-1][node_id(module_data['name'], func_data['qualified_name'])] = func_data.pop('source', '')
+                func_data['source_shard'] = len(shards) - 1
+
+        for i, sources in enumerate(shards):
+            write(f"sources-{i}", sources)
+        write('graph', modules_data)
+        print(f"📦 Graph + {len(shards)} source shards written to {data_dir}/")
+        return {'dir': os.path.basename(data_dir), 'ext': ext, 'gzip': compress}
         
-    def _generate_html_template(self, data):
-        """Generate the HTML template with embedded JSON data."""
+    def _generate_html_template(self, data, data_config=None):
+        """Generate the HTML template with embedded JSON data (or a data config to load it)."""
         js_data = json.dumps(data)
+        js_config = json.dumps(data_config)
         
         html = f'''<!DOCTYPE html>
     <html lang="en">
@@ -455,8 +737,47 @@ class ModuleAnalyzer:
         </div>
 
         <script>
-            // Data from Python script
-            const modulesData = {js_data};
+            // Data from Python script: inline, or in files next to this page
+            const dataConfig = {js_config};
+            let modulesData = {js_data};
+            const sourceShards = {{}};
+            
+            const FunctionMapData = {{
+                pending: {{}},
+                receive(name, payload) {{
+                    const resolve = this.pending[name];
+                    delete this.pending[name];
+                    if (resolve) resolve(payload);
+                }}
+            }};
+            window.FunctionMapData = FunctionMapData;
+            
+            function loadDataFile(name) {{
+                const url = `${{dataConfig.dir}}/${{name}}${{dataConfig.ext}}`;
+                if (dataConfig.gzip) {{
+                    // fetch is blocked on file://, so gzipped data needs an http server
+                    return fetch(url).then(r => {{
+                        if (!r.ok) throw new Error(`${{url}}: ${{r.status}}`);
+                        return new Response(r.body.pipeThrough(new DecompressionStream('gzip'))).json();
+                    }});
+                }}
+                return new Promise((resolve, reject) => {{
+                    FunctionMapData.pending[name] = resolve;
+                    const script = document.createElement('script');
+                    script.src = url;
+                    script.onerror = () => reject(new Error(`Could not load ${{url}}`));
+                    document.head.appendChild(script);
+                }});
+            }}
+            
+            function loadSource(func) {{
+                if (func.source !== undefined) return Promise.resolve(func.source);
+                const shard = func.source_shard;
+                if (!sourceShards[shard]) {{
+                    sourceShards[shard] = loadDataFile(`sources-${{shard}}`);
+                }}
+                return sourceShards[shard].then(sources => sources[`${{func.module}}.${{func.qualified_name}}`]);
+            }}
             
             // Global variables
             let functions = {{}};
@@ -475,12 +796,21 @@ class ModuleAnalyzer:
             // Initialize
             document.addEventListener('DOMContentLoaded', function() {{
                 console.log("Initializing function map visualization...");
-                console.log("Modules data:", modulesData);
-                
-                initializeFunctions();
-                initializeUI();
-                renderFunctionList();
-                detectEntryPoint();
+                const ready = dataConfig
+                    ? loadDataFile('graph').then(data => {{ modulesData = data; }})
+                    : Promise.resolve();
+                
+                ready.then(() => {{
+                    console.log("Modules data:", modulesData);
+                    initializeFunctions();
+                    initializeUI();
+                    renderFunctionList();
+                    detectEntryPoint();
+                }}).catch(err => {{
+                    console.error("Error loading function map data:", err);
+                    document.getElementById('detailsArea').innerHTML =
+                        `<h3 class="details-header">Could not load data: ${{err.message}}</h3>`;
+                }});
             }});
             
             function initializeFunctions() {{
@@ -493,16 +823,8 @@ class ModuleAnalyzer:
                             ...func,
                             module: module.name,
                             modulePath: module.path,
-                            // Convert calls to include module name if not explicitly included
-                            calls: (func.calls || []).map(call => {{
-                                if (call.includes('.')) {{
-                                    return call;
-                                }} else {{
-                                    // Check if call exists in this module
-                                    const inModule = module.functions.some(f => f.name === call);
-                                    return inModule ? `${{module.name}}.${{call}}` : call;
-                                }}
-                            }})
+                            // Resolved by ModuleAnalyzer.resolve_calls; externals stay as written
+                            calls: (func.callees || []).concat(func.external || [])
                         }};
                     }});
                 }});
@@ -702,54 +1024,12 @@ class ModuleAnalyzer:
             
             function autoLayoutGraph(graph, rootId) {{
                 console.log("Auto-layouting graph from root:", rootId);
-                // Simple layer-based layout
-                const layers = {{}};
-                const visited = new Set();
-                
-                function assignLayer(id, layer) {{
-                    if (visited.has(id)) {{
-                        return;
-                    }}
-                    
-                    visited.add(id);
-                    
-                    if (!layers[layer]) {{
-                        layers[layer] = [];
-                    }}
-                    
-                    layers[layer].push(id);
-                    
-                    const node = graph[id];
-                    if (node && node.children) {{
-                        node.children.forEach(childId => {{
-                            if (graph[childId]) {{
-                                assignLayer(childId, layer + 1);
-                            }}
-                        }});
-                    }}
-                }}
-                
-                // Start with root node
-                assignLayer(rootId, 0);
-                
-                console.log("Created", Object.keys(layers).length, "layers");
-                
-                // Position nodes by layer
-                const layerHeight = 180;
-                const nodeWidth = 200;
-                const nodeMargin = 30;
-                
-                Object.keys(layers).forEach(layer => {{
-                    const nodesInLayer = layers[layer];
-                    const layerWidth = nodesInLayer.length * (nodeWidth + nodeMargin);
-                    const startX = -layerWidth / 2 + nodeWidth / 2;
-                    
-                    nodesInLayer.forEach((id, index) => {{
-                        nodePositions[id] = {{
-                            x: startX + index * (nodeWidth + nodeMargin),
-                            y: parseInt(layer) * layerHeight
-                        }};
-                    }});
+                // Positions are precomputed with the data (call_graph.layered_layout);
+                // shift them so the root sits at the origin
+                const root = graph[rootId].func;
+                Object.keys(graph).forEach(id => {{
+                    const f = graph[id].func;
+                    nodePositions[id] = {{ x: f.x - root.x, y: f.y - root.y }};
                 }});
                 
                 // Center the view
@@ -929,7 +1209,10 @@ class ModuleAnalyzer:
                 }}
                 
                 // Format the source code with simple syntax highlighting
-                let sourceCode = func.source || "Source code not available";
+                // (external data: fetched from its shard below, on first open)
+                let sourceCode = func.source === undefined
+                    ? "Loading source..."
+                    : func.source || "Source code not available";
                 
                 // Build HTML
                 let html = `
@@ -982,8 +1265,7 @@ class ModuleAnalyzer:
                 
                 // Called by
                 const calledBy = Object.values(functions).filter(f => 
-                    (f.calls || []).includes(func.qualified_name) || 
-                    (f.calls || []).includes(func.name)
+                    (f.callees || []).includes(funcId)
                 );
                 
                 html += `
@@ -1016,6 +1298,16 @@ class ModuleAnalyzer:
                 
                 detailsArea.innerHTML = html;
                 
+                if (func.source === undefined) {{
+                    loadSource(func).then(source => {{
+                        func.source = source || '';
+                        const pre = detailsArea.querySelector('.source-code');
+                        if (pre && selectedFunction === funcId) {{
+                            pre.textContent = func.source || "Source code not available";
+                        }}
+                    }}).catch(err => console.error("Error loading source:", err));
+                }}
+                
                 // Add event listeners to function links
                 document.querySelectorAll('.function-link').forEach(link => {{
                     link.addEventListener('click', () => {{
@@ -1219,6 +1511,10 @@ def main():
     parser.add_argument('target', help='Python file or directory to analyze')
     parser.add_argument('-o', '--output', default='function_map.html', help='Output HTML file')
     parser.add_argument('-r', '--recursive', action='store_true', help='Recursively analyze directories')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='Parser processes for directories (0 = code_parser.PARSE_WORKERS)')
+    parser.add_argument('--external-data', action='store_true', help='Write a slim HTML shell plus a <output>_data directory; sources load per function on click')
+    parser.add_argument('--gzip', action='store_true', help='Gzip the external data files (the page must then be served over http)')
+    parser.add_argument('--shard-size', type=int, default=None, help='Functions per source shard for very large repos (default: one shard per module)')
     
     args = parser.parse_args()
     
@@ -1227,12 +1523,12 @@ def main():
     if os.path.isfile(args.target) and args.target.endswith('.py'):
         analyzer.analyze_file(args.target)
     elif os.path.isdir(args.target):
-        analyzer.analyze_directory(args.target, args.recursive)
+        analyzer.analyze_directory(args.target, args.recursive, args.workers or None)
     else:
         print(f"Error: {args.target} is not a Python file or directory")
         return 1
     
-    analyzer.generate_interactive_html(args.output)
+    analyzer.generate_interactive_html(args.output, args.external_data, args.gzip, args.shard_size)
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,234 @@
+import os
+import json
+import mmap
+import time
+import uuid
+import hashlib
+
+# Column metadata (small, loaded eagerly) and the function bodies (large,
+# read on demand through mmap). The bodies are written to a file named
+# after their content hash (functions-<hash>.bin) that the metadata points
+# to, so replacing the metadata swaps both at once; STORE_DATA_FILE is only
+# read for stores written before that
+STORE_META_FILE = "functions_meta.json"
+STORE_DATA_FILE = "functions.bin"
+
+# Written by older versions; read only when no store exists yet
+LEGACY_FUNCTIONS_FILE = "parsed_functions.json"
+
+# Written last, once every other artifact of a workspace is in place;
+# serving engines reload the whole set when it changes, never part of it
+ARTIFACTS_VERSION_FILE = "artifacts_version.json"
+
+_COLUMNS = ("function_name", "qualified_name", "args", "docstring", "line_number", "end_line")
+
+
+def write_atomically(path, write):
+    """Call write(tmp_path), then rename over path.
+
+    Processes that already mmapped the old file keep a valid mapping
+    instead of seeing it rewritten (or truncated) underneath them.
+    """
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_json_atomically(path, data, **kwargs):
+    """json.dump data to path via write_atomically; readers never see half a file."""
+    def write(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, **kwargs)
+    write_atomically(path, write)
+    return path
+
+
+def publish_artifacts(artifact_dir=".", **info):
+    """Mark the artifacts in artifact_dir as one complete set; returns its version.
+
+    Call after every other artifact has been written.
+    """
+    version = uuid.uuid4().hex
+    write_json_atomically(os.path.join(artifact_dir, ARTIFACTS_VERSION_FILE),
+                          dict(info, version=version, published=time.time()))
+    return version
+
+
+def read_artifacts_version(artifact_dir="."):
+    """Version of the last published artifact set (None if never published)."""
+    try:
+        with open(os.path.join(artifact_dir, ARTIFACTS_VERSION_FILE), "r", encoding="utf-8") as f:
+            return json.load(f).get("version")
+    except (OSError, ValueError):
+        return None
+
+
+def _versioned_data_path(data_path, content_hash):
+    root, ext = os.path.splitext(data_path)
+    return f"{root}-{content_hash[:16]}{ext}"
+
+
+def _data_file(meta):
+    """Blob file name a store's metadata points to (None for older stores)."""
+    return meta.get("data_file")
+
+
+def write_function_store(functions, meta_path=STORE_META_FILE, data_path=STORE_DATA_FILE):
+    """Write parsed functions as column metadata + an offset-indexed blob file.
+
+    Each function's code is stored UTF-8 encoded in a blob file named
+    after ``data_path`` and the content hash; the metadata keeps its byte
+    offset and length so a single body can be read without deserialising
+    the rest. The metadata is written last and is the commit point: a
+    reader sees either the old pair or the new one. Blob files older than
+    the previous store's are removed. Returns the store's content hash
+    (code and metadata), which is also recorded in the metadata.
+    """
+    files = []
+    file_ids = {}
+    columns = {name: [] for name in _COLUMNS}
+    columns["file"] = []
+    offsets, lengths = [], []
+    digest = hashlib.sha256()
+
+    def write_data(path):
+        with open(path, "wb") as out:
+            offset = 0
+            for func in functions:
+                file_id = file_ids.setdefault(func["file"], len(files))
+                if file_id == len(files):
+                    files.append(func["file"])
+                columns["file"].append(file_id)
+                for name in _COLUMNS:
+                    columns[name].append(func.get(name))
+                blob = func["code"].encode("utf-8")
+                out.write(blob)
+                digest.update(blob)
+                offsets.append(offset)
+                lengths.append(len(blob))
+                offset += len(blob)
+
+    def write_meta(path):
+        with open(path, "w", encoding="utf-8") as out:
+            json.dump({
+                "count": len(functions),
+                "content_hash": content_hash,
+                "data_file": os.path.basename(versioned_path),
+                "files": files,
+                "columns": columns,
+                "code_offsets": offsets,
+                "code_lengths": lengths,
+            }, out, separators=(",", ":"))
+
+    tmp_path = f"{data_path}.tmp"
+    write_data(tmp_path)
+    digest.update(json.dumps([files, columns, lengths], separators=(",", ":")).encode("utf-8"))
+    content_hash = digest.hexdigest()
+    versioned_path = _versioned_data_path(data_path, content_hash)
+    os.replace(tmp_path, versioned_path)
+
+    # a reader may have just read the previous metadata: keep its blob file
+    keep = {os.path.basename(versioned_path)}
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            keep.add(_data_file(json.load(f)) or os.path.basename(data_path))
+    write_atomically(meta_path, write_meta)
+    _remove_stale_data(data_path, keep)
+    return content_hash
+
+
+def _remove_stale_data(data_path, keep):
+    directory = os.path.dirname(data_path) or "."
+    root, ext = os.path.splitext(os.path.basename(data_path))
+    for name in os.listdir(directory):
+        stale = name == root + ext or name.startswith(f"{root}-") and name.endswith(ext)
+        if stale and name not in keep:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass  # still open elsewhere (Windows); the next write retries
+
+
+class FunctionStore:
+    """Read-only, list-like view of the parsed functions.
+
+    ``store[i]`` returns the same dict shape parsed_functions.json had;
+    ``store.meta(i)`` skips the code and never touches the blob file.
+    """
+
+    def __init__(self, meta, data=None, records=None):
+        self._meta = meta
+        self._data = data          # mmap of the blob file
+        self._records = records    # in-memory records (legacy JSON)
+        self.data_path = None      # blob file path, set by load()
+
+    @classmethod
+    def load(cls, meta_path=STORE_META_FILE, data_path=STORE_DATA_FILE):
+        """Open a store; the blob file is the one its metadata names."""
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if _data_file(meta):
+            data_path = os.path.join(os.path.dirname(meta_path), _data_file(meta))
+        data = None
+        if os.path.getsize(data_path):
+            with open(data_path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        store = cls(meta, data)
+        store.data_path = data_path
+        return store
+
+    @classmethod
+    def from_records(cls, records):
+        return cls({"count": len(records)}, records=records)
+
+    def __len__(self):
+        return self._meta["count"]
+
+    @property
+    def content_hash(self):
+        """Hash of the code + metadata written (None for a legacy store)."""
+        return self._meta.get("content_hash")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def _check(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+
+    def meta(self, i):
+        """Everything but the code for function i."""
+        self._check(i)
+        if self._records is not None:
+            return {k: v for k, v in self._records[i].items() if k != "code"}
+        columns = self._meta["columns"]
+        record = {"file": self._meta["files"][columns["file"][i]]}
+        record.update((name, columns[name][i]) for name in _COLUMNS)
+        return record
+
+    def code(self, i):
+        """Source of function i, read straight from the mmapped blob."""
+        self._check(i)
+        if self._records is not None:
+            return self._records[i]["code"]
+        offset = self._meta["code_offsets"][i]
+        length = self._meta["code_lengths"][i]
+        return self._data[offset:offset + length].decode("utf-8") if length else ""
+
+    def __getitem__(self, i):
+        record = self.meta(i)
+        record["code"] = self.code(i)
+        return record
+
+
+def load_function_store(meta_path=STORE_META_FILE, data_path=STORE_DATA_FILE,
+                        legacy_path=LEGACY_FUNCTIONS_FILE):
+    """The function store, falling back to a legacy parsed_functions.json."""
+    if not os.path.exists(meta_path) and os.path.exists(legacy_path):
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            return FunctionStore.from_records(json.load(f))
+    return FunctionStore.load(meta_path, data_path)
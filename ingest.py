@@ -0,0 +1,262 @@
+import os
+import time
+import uuid
+import zipfile
+import threading
+import traceback
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from code_parser import parse_sources, save_parse, to_parsed_function, file_imports
+from embed_functions import compute_embeddings, build_index
+from function_mapper import ModuleAnalyzer
+from call_graph import build_call_graph, write_call_graph, CallAdjacency, CALL_GRAPH_FILE, CALL_ADJACENCY_FILE
+from function_store import write_json_atomically, publish_artifacts
+
+MODULES_JSON   = 'modules_data.json'
+
+# Upload limits: .py members read from an archive, bytes per member and in
+# total (uncompressed, checked while reading, not just from the headers)
+MAX_ZIP_MEMBERS        = 50000
+MAX_MEMBER_BYTES       = 5 * 1024 * 1024
+MAX_UNCOMPRESSED_BYTES = 1024 * 1024 * 1024
+
+STAGES = ('extract', 'parse', 'graph', 'embed', 'index', 'publish')
+
+
+def build_modules_json(file_records, file_imports=None):
+    # reuse the records from parse_codebase instead of parsing every file again
+    analyzer = ModuleAnalyzer()
+    analyzer.add_file_map(file_records, file_imports)
+    analyzer.resolve_calls()
+
+    # where each function sits in the function store (parse_codebase's order),
+    # so the diagram can fetch its source by index instead of shipping it
+    flat = (r for records in file_records.values() for r in records)
+    store_index = {(r['file'], r['line_number']): i for i, r in enumerate(flat)}
+
+    modules_data = []
+    for module_name, info in analyzer.modules.items():
+        modules_data.append({
+            'name': module_name,
+            'path': info['path'],
+            # the module's import table, so saved data can be re-resolved
+            'imports': info['imports'] or {},
+            'functions': [
+                {**{k: v for k, v in f.items() if k not in ('source', 'imports')},
+                 'store_index': store_index.get((f['file'], f['line_number']))}
+                for f in info['functions'].values()
+            ]
+        })
+
+    return modules_data
+
+
+def write_modules_json(modules_data, path=MODULES_JSON):
+    write_json_atomically(path, modules_data, indent=2)
+
+
+def python_members(zf):
+    """The .py entries of an archive worth parsing, checked against the limits.
+
+    Skips directories, macOS metadata (__MACOSX/, ._*) and anything that
+    isn't a relative .py path. Raises ValueError if the archive is over
+    MAX_ZIP_MEMBERS or MAX_UNCOMPRESSED_BYTES by its own headers.
+    """
+    members = []
+    for info in zf.infolist():
+        parts = info.filename.replace('\\', '/').split('/')
+        if (info.is_dir() or not parts[-1].endswith('.py') or parts[-1].startswith('._')
+                or '__MACOSX' in parts or '..' in parts or info.filename.startswith('/')):
+            continue
+        if info.file_size > MAX_MEMBER_BYTES:
+            print(f"⚠️ Skipping {info.filename}: {info.file_size} bytes is over the per-file limit")
+            continue
+        members.append(info)
+    if len(members) > MAX_ZIP_MEMBERS:
+        raise ValueError(f"❌ Archive has {len(members)} Python files (limit {MAX_ZIP_MEMBERS}).")
+    total = sum(info.file_size for info in members)
+    if total > MAX_UNCOMPRESSED_BYTES:
+        raise ValueError(f"❌ Archive unpacks to {total} bytes of Python (limit {MAX_UNCOMPRESSED_BYTES}).")
+    return members
+
+
+def read_python_members(zf, members):
+    """Yield (path, source) for each member, decoded in memory.
+
+    Sizes are enforced on the bytes actually inflated, since a crafted
+    archive can understate them in its headers.
+    """
+    total = 0
+    for info in members:
+        with zf.open(info) as fp:
+            data = fp.read(MAX_MEMBER_BYTES + 1)
+        if len(data) > MAX_MEMBER_BYTES:
+            print(f"⚠️ Skipping {info.filename}: over the per-file limit")
+            continue
+        total += len(data)
+        if total > MAX_UNCOMPRESSED_BYTES:
+            raise ValueError(f"❌ Archive unpacks to more than {MAX_UNCOMPRESSED_BYTES} bytes of Python.")
+        try:
+            source = data.decode('utf-8')
+        except UnicodeDecodeError:
+            source = data.decode('latin-1')
+        yield info.filename.replace('\\', '/'), source
+
+
+def new_job_id():
+    return uuid.uuid4().hex[:12]
+
+
+class IngestJob:
+    """Status of one upload as it moves through the ingestion stages.
+
+    Artifacts are written under ``artifact_dir`` (the workspace's directory).
+    With ``remove_zip`` the archive is deleted once the job has finished.
+    """
+
+    def __init__(self, zip_path, artifact_dir='.', workspace=None, job_id=None, remove_zip=False):
+        self.id = job_id or new_job_id()
+        self.zip_path = zip_path
+        self.remove_zip = remove_zip
+        self.artifact_dir = artifact_dir
+        self.workspace = workspace
+        self.status = 'queued'
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.stages = {name: {'status': 'pending', 'seconds': None} for name in STAGES}
+        self.details = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage and record whether it finished or failed."""
+        self.stages[name]['status'] = 'running'
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.stages[name]['status'] = 'failed'
+            raise
+        else:
+            self.stages[name]['status'] = 'done'
+        finally:
+            self.stages[name]['seconds'] = round(time.perf_counter() - start, 3)
+
+    def skip(self, name):
+        self.stages[name]['status'] = 'skipped'
+
+    def to_dict(self):
+        done = sum(1 for s in self.stages.values() if s['status'] in ('done', 'skipped'))
+        return {
+            'id': self.id,
+            'workspace': self.workspace,
+            'status': self.status,
+            'error': self.error,
+            'progress': done / len(STAGES),
+            'stages': [dict(name=name, **info) for name, info in self.stages.items()],
+            'details': self.details,
+            'elapsed': round((self.finished or time.time()) - self.created, 3),
+        }
+
+
+def run_ingest(job):
+    """Extract → parse → graph → embed → index → publish for one uploaded zip.
+
+    Python members are read and parsed straight from the archive; nothing
+    is extracted to disk. The function store and the call graph (whose
+    nodes point into the store) are only written in the publish stage,
+    together, so readers never pair a new store with an old graph. The
+    artifacts version marker is written last: serving engines only reload
+    once it changes, and then load the whole set.
+    """
+    def path(name):
+        return os.path.join(job.artifact_dir, name)
+
+    with zipfile.ZipFile(job.zip_path, 'r') as zf:
+        with job.stage('extract'):
+            members = python_members(zf)
+            job.details['members'] = len(members)
+
+        with job.stage('parse'):
+            file_records, manifest = parse_sources(read_python_members(zf, members), len(members),
+                                                   artifact_dir=job.artifact_dir)
+        functions = [to_parsed_function(r) for records in file_records.values() for r in records]
+        job.details['files'] = len(file_records)
+        job.details['functions'] = len(functions)
+
+    with job.stage('graph'):
+        modules_data = build_modules_json(file_records, file_imports(manifest))
+        graph = build_call_graph(modules_data)
+        job.details['edges'] = len(graph['edges'])
+
+    if functions:
+        with job.stage('embed'):
+            embeddings, hashes, report = compute_embeddings(functions, artifact_dir=job.artifact_dir)
+            job.details['embedding'] = report
+        with job.stage('index'):
+            build_index(functions, embeddings, hashes, artifact_dir=job.artifact_dir)
+    else:
+        print("⚠️ No functions found to embed.")
+        job.skip('embed')
+        job.skip('index')
+
+    with job.stage('publish'):
+        # the graph records which store it indexes, so the diagram can
+        # version /functions/<i> URLs by the store's content
+        graph['store_version'] = save_parse(file_records, manifest, job.artifact_dir)
+        write_modules_json(modules_data, path(MODULES_JSON))
+        write_call_graph(graph, path(CALL_GRAPH_FILE))
+        CallAdjacency.from_graph(graph).save(path(CALL_ADJACENCY_FILE))
+        publish_artifacts(job.artifact_dir, store_version=graph['store_version'])
+
+
+class IngestQueue:
+    """Runs ingestion jobs on a background thread, one at a time.
+
+    Jobs share the on-disk artifacts, so they are serialised; the web
+    server keeps answering /chat from the engine's in-memory copy while a
+    job runs. ``on_complete(job)`` runs after the stages succeed and before
+    the job is reported as done.
+    """
+
+    def __init__(self, on_complete=None, max_jobs=100):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ingest')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._on_complete = on_complete
+        self._max_jobs = max_jobs
+
+    def submit(self, zip_path, artifact_dir='.', workspace=None, job_id=None, remove_zip=False):
+        job = IngestJob(zip_path, artifact_dir, workspace, job_id, remove_zip)
+        with self._lock:
+            self._jobs[job.id] = job
+            # forget the oldest finished jobs once we hold too many
+            finished = [j for j in self._jobs.values() if j.finished]
+            for old in finished[:max(0, len(self._jobs) - self._max_jobs)]:
+                del self._jobs[old.id]
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job):
+        job.status = 'running'
+        try:
+            run_ingest(job)
+            if self._on_complete:
+                self._on_complete(job)
+            job.status = 'done'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            traceback.print_exc()
+        finally:
+            if job.remove_zip:
+                try:
+                    os.remove(job.zip_path)
+                except OSError as e:
+                    print(f"⚠️ Could not remove {job.zip_path}: {e}")
+            job.finished = time.time()
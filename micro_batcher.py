@@ -0,0 +1,93 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+# Most items run together, and how long the first item of a batch waits for
+# company; the wait is a floor on latency, so it is kept to a few ms
+BATCH_MAX_SIZE    = 32
+BATCH_MAX_WAIT_MS = 4
+
+# A worker with nothing to do exits after this long (and is restarted by
+# the next submit), so batchers of evicted engines don't keep a thread
+WORKER_IDLE_SECONDS = 30
+
+
+class MicroBatcher:
+    """Collects concurrent calls and runs them as one batch.
+
+    ``run_batch(items)`` gets a list of submitted items and returns one
+    result per item, in order. Callers block on (or hold) a Future; if
+    run_batch raises, every caller of that batch gets the exception.
+    A max_batch_size of 1 turns batching off: calls run in the caller's
+    thread.
+    """
+
+    def __init__(self, run_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending = deque()  # (item, future)
+        self._cond = threading.Condition()
+        self._worker = None
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+
+    def submit(self, item):
+        future = Future()
+        if self.max_batch_size <= 1:
+            self._execute([(item, future)])
+            return future
+        with self._cond:
+            self._pending.append((item, future))
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+            self._cond.notify()
+        return future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._pending:
+                    self._cond.wait(WORKER_IDLE_SECONDS)
+                    if not self._pending:
+                        self._worker = None
+                        return
+                # the window opens with the oldest waiting item
+                deadline = time.monotonic() + self.max_wait
+                while len(self._pending) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                count = min(len(self._pending), self.max_batch_size)
+                batch = [self._pending.popleft() for _ in range(count)]
+            self._execute(batch)
+
+    def _execute(self, batch):
+        self.batches += 1
+        self.items += len(batch)
+        self.largest = max(self.largest, len(batch))
+        try:
+            results = self.run_batch([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch": round(self.items / self.batches, 2) if self.batches else None,
+            "largest_batch": self.largest,
+        }
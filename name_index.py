@@ -0,0 +1,111 @@
+import os
+import re
+import json
+import math
+
+from function_store import write_json_atomically
+
+NAME_INDEX_FILE = "name_index.json"
+
+# Words that show up in nearly every question but say nothing about names
+STOPWORDS = {
+    "a", "an", "and", "are", "does", "do", "how", "in", "is", "it", "of",
+    "the", "this", "to", "what", "where", "which", "who", "why", "with",
+}
+
+# Per-field weight of a token; a function keeps the best weight per token
+FIELD_WEIGHTS = {
+    "name": 3.0,       # the whole function name, e.g. "process_rows"
+    "name_part": 2.0,  # "process", "rows"
+    "qualified": 1.0,  # class part of "ModuleAnalyzer.analyze_file"
+    "module": 0.5,     # file stem, e.g. "processor"
+    "arg": 0.5,        # parameter identifiers
+}
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_CAMEL = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def split_identifier(identifier):
+    """Lower-cased parts of a snake_case / camelCase / dotted identifier."""
+    parts = []
+    for chunk in re.split(r"[^A-Za-z0-9]+", identifier):
+        parts.extend(p.lower() for p in _CAMEL.findall(chunk))
+    return parts
+
+
+def tokenize_query(text):
+    """Name-index tokens for free text: whole identifiers plus their parts."""
+    tokens = set()
+    for word in _IDENTIFIER.findall(text):
+        lowered = word.lower()
+        if lowered in STOPWORDS:
+            continue
+        tokens.add(lowered)
+        tokens.update(p for p in split_identifier(word) if p not in STOPWORDS)
+    return tokens
+
+
+def _function_tokens(func):
+    name = func["function_name"]
+    qualified = func.get("qualified_name") or name
+    weights = {}
+
+    def add(token, field):
+        weights[token] = max(weights.get(token, 0.0), FIELD_WEIGHTS[field])
+
+    add(name.lower(), "name")
+    for part in split_identifier(name):
+        add(part, "name_part")
+    for part in split_identifier(qualified):
+        add(part, "qualified")
+    add(qualified.lower(), "qualified")
+    module = os.path.splitext(os.path.basename(func.get("file", "")))[0]
+    for part in split_identifier(module):
+        add(part, "module")
+    for arg in func.get("args", []):
+        if arg != "self":
+            add(arg.lower(), "arg")
+    return weights
+
+
+class NameIndex:
+    """Token -> functions index over names, qualified names and identifiers.
+
+    Built once at ingest time; a lookup is a handful of dict reads, so it
+    stays sub-millisecond regardless of the number of functions.
+    """
+
+    def __init__(self, postings, count):
+        self.postings = postings  # token -> [[function index, weight], ...]
+        self.count = count
+
+    @classmethod
+    def build(cls, functions):
+        postings = {}
+        for i, func in enumerate(functions):
+            for token, weight in _function_tokens(func).items():
+                postings.setdefault(token, []).append([i, weight])
+        return cls(postings, len(functions))
+
+    @classmethod
+    def load(cls, path=NAME_INDEX_FILE):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["postings"], data["count"])
+
+    def save(self, path=NAME_INDEX_FILE):
+        write_json_atomically(path, {"count": self.count, "postings": self.postings})
+
+    def search(self, question, limit=None):
+        """[(function index, score)] best first; score is idf-weighted."""
+        scores = {}
+        for token in tokenize_query(question):
+            posting = self.postings.get(token)
+            if not posting:
+                continue
+            idf = math.log(1 + self.count / len(posting))
+            for i, weight in posting:
+                scores[i] = scores.get(i, 0.0) + weight * idf
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit else ranked
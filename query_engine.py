@@ -0,0 +1,380 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+
+from embed_functions import get_model, model_encode
+import numpy as np
+
+from code_search import (search_functions, dense_candidates, expand_hits, QueryEncoder, load_name_index,
+                         load_bm25_index, load_faiss_index, index_info, EXPANSION_LIMIT, CANDIDATE_FACTOR)
+from micro_batcher import MicroBatcher, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+from call_graph import CallAdjacency, CALL_ADJACENCY_FILE
+from embed_functions import EMBEDDINGS_FILE
+from ask_question import answer_from_functions, stream_answer_from_functions
+from name_index import NAME_INDEX_FILE
+from bm25_index import BM25_INDEX_FILE
+from answer_cache import AnswerCache
+from function_store import (load_function_store, read_artifacts_version, STORE_META_FILE, STORE_DATA_FILE,
+                            LEGACY_FUNCTIONS_FILE)
+
+INDEX_FILE     = "code_embeddings.index"
+METADATA_FILE  = "code_metadata.json"
+
+NOT_INDEXED_ANSWER = "⚠️ No codebase indexed yet — upload a ZIP first."
+
+# How often a serving engine checks its artifacts' version. The process that
+# ran an ingest reloads at once; other workers (e.g. gunicorn) notice the
+# new artifacts within this many seconds
+RELOAD_CHECK_SECONDS = 2
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[pos]
+
+
+class QueryEngine:
+    """Long-lived search state shared by every /chat request.
+
+    The CodeBERT model is loaded once per process. The FAISS index and the
+    JSON artifacts are loaded lazily from ``artifact_dir`` and re-read by
+    reload(), as one set, only when a new set has been published, e.g.
+    after /upload rebuilt them; requests run that check at most every
+    RELOAD_CHECK_SECONDS, so every worker process picks up new artifacts.
+    Engines of different workspaces can share one
+    ``encoder`` (and so one model and query-embedding cache).
+
+    Concurrent requests are micro-batched: questions are embedded in one
+    forward pass (by the encoder) and searched with one index.search call,
+    up to ``batch_size`` at a time after waiting at most ``batch_wait_ms``.
+    """
+
+    def __init__(self, latency_window=500, answer_cache=None, artifact_dir=".", encoder=None,
+                 batch_size=BATCH_MAX_SIZE, batch_wait_ms=BATCH_MAX_WAIT_MS):
+        self._lock = threading.RLock()
+        self.artifact_dir = artifact_dir
+        self.model = encoder.model if encoder is not None else None
+        self.encoder = encoder
+        self.index = None
+        self.metadata = []
+        self.function_data = []
+        self.name_index = None
+        self.bm25_index = None
+        self.call_adjacency = None
+        self.embeddings = None
+        self._loaded = []
+        self._last_check = 0.0
+        self.index_version = None
+        self.answer_cache = answer_cache if answer_cache is not None else AnswerCache()
+        self._latencies = deque(maxlen=latency_window)
+        self.batch_size = batch_size
+        self.batch_wait_ms = batch_wait_ms
+        self.search_batcher = MicroBatcher(self._search_batch, batch_size, batch_wait_ms)
+
+    # ── loading ────────────────────────────────────────────────
+    def _path(self, name):
+        return os.path.join(self.artifact_dir, name)
+
+    def load_model(self):
+        with self._lock:
+            if self.model is None:
+                self.model = get_model()
+                self.encoder = QueryEncoder(self.model, batch_size=self.batch_size,
+                                            batch_wait_ms=self.batch_wait_ms)
+            return self.model
+
+    def _load_index(self, path):
+        self.index = load_faiss_index(path, index_info(self.metadata),
+                                      embeddings_path=self._path(EMBEDDINGS_FILE))
+        # mapped, not read: only the rows of expanded neighbours are touched
+        embeddings_path = self._path(EMBEDDINGS_FILE)
+        self.embeddings = np.load(embeddings_path, mmap_mode="r") if os.path.exists(embeddings_path) else None
+
+    def _load_metadata(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            self.metadata = json.load(f)
+
+    def _load_functions(self, path):
+        # list-like FunctionStore: metadata in memory, code read via mmap
+        self.function_data = load_function_store(self._path(STORE_META_FILE), self._path(STORE_DATA_FILE),
+                                                 self._path(LEGACY_FUNCTIONS_FILE))
+
+    def _load_name_index(self, path):
+        self.name_index = load_name_index(self.function_data, path)
+
+    def _load_bm25_index(self, path):
+        self.bm25_index = load_bm25_index(self.function_data, path)
+
+    def _load_call_adjacency(self, path):
+        self.call_adjacency = CallAdjacency.load(path)
+
+    def _artifacts(self):
+        """(path, loader) of every artifact, in load order."""
+        functions_file = self._path(STORE_META_FILE)
+        if not os.path.exists(functions_file):
+            functions_file = self._path(LEGACY_FUNCTIONS_FILE)
+        return [
+            # metadata first: it says how the index should be opened
+            (self._path(METADATA_FILE), self._load_metadata),
+            (self._path(INDEX_FILE), self._load_index),
+            (functions_file, self._load_functions),
+            (self._path(NAME_INDEX_FILE), self._load_name_index),
+            (self._path(BM25_INDEX_FILE), self._load_bm25_index),
+            (self._path(CALL_ADJACENCY_FILE), self._load_call_adjacency),
+        ]
+
+    def _artifacts_version(self, artifacts):
+        """The published version marker; artifacts from before it count by their mtimes."""
+        version = read_artifacts_version(self.artifact_dir)
+        if version is None:
+            mtimes = [_mtime(path) for path, _ in artifacts]
+            version = ":".join(str(m) for m in mtimes) if any(mtimes) else None
+        return version
+
+    def reload(self):
+        """Re-read the artifacts if a new set has been published since the last load.
+
+        Only the version marker (written last by an ingest) is checked, and
+        the whole set is loaded together under the lock, so searches never
+        see a new index with an old store. Returns the paths (re)loaded.
+        """
+        with self._lock:
+            artifacts = self._artifacts()
+            version = self._artifacts_version(artifacts)
+            if version is None or version == self.index_version:
+                return []
+            reloaded = []
+            for path, loader in artifacts:
+                if os.path.exists(path):
+                    loader(path)
+                    reloaded.append(path)
+            self._loaded = reloaded
+            # new artifacts = new version; cached answers for the old one stop matching
+            self.index_version = version
+        print(f"🔁 Query engine reloaded: {', '.join(reloaded)}")
+        return reloaded
+
+    @property
+    def ready(self):
+        return self.index is not None and bool(self.function_data)
+
+    def memory_estimate(self):
+        """Bytes of the artifacts this engine has loaded (on-disk size as a proxy).
+
+        mmapped files are counted in full, so this is an upper bound on what
+        the engine can pin in memory rather than its current footprint.
+        """
+        with self._lock:
+            paths = list(self._loaded)
+            if self.index is not None:
+                paths.append(self._path(EMBEDDINGS_FILE))
+            data_path = getattr(self.function_data, "data_path", None)
+            if data_path:
+                paths.append(data_path)
+        return sum(os.path.getsize(p) for p in set(paths) if os.path.exists(p))
+
+    def warm_up(self):
+        """Load the model and artifacts and run one throwaway query.
+
+        Call at startup so the first real /chat request doesn't pay for
+        model load and the first forward pass.
+        """
+        start = time.perf_counter()
+        self.load_model()
+        self.reload()
+        with self._lock:
+            model_encode(self.model, ["warm up"])
+        print(f"🔥 Query engine warm in {time.perf_counter() - start:.2f}s")
+
+    # ── querying ───────────────────────────────────────────────
+    def _prepare(self):
+        """Make sure model and artifacts are loaded; False if nothing is indexed."""
+        self.load_model()
+        now = time.monotonic()
+        if not self.ready or now - self._last_check >= RELOAD_CHECK_SECONDS:
+            self._last_check = now
+            self.reload()
+        if not self.ready:
+            return False
+        if self.name_index is None:
+            self.name_index = load_name_index(self.function_data)
+        if self.bm25_index is None:
+            self.bm25_index = load_bm25_index(self.function_data)
+        return True
+
+    def search(self, question, k=3, query_embedding=None, expand=EXPANSION_LIMIT):
+        """Return the top-k hits for a question, each with per-retriever scores.
+
+        Up to ``expand`` functions the hits call (see code_search.expand_hits)
+        follow them, ranked by call distance and similarity; they are
+        labelled ``"via": "call_graph"``. Off by default; needs the call
+        adjacency written at ingest.
+        Concurrent calls are searched together (see _search_batch).
+        """
+        result = self.search_batcher((question, k, query_embedding, expand))
+        return None if result is None else result[0]
+
+    def _search_batch(self, requests):
+        """(hits, functions) for each (question, k, query_embedding, expand) of a batch.
+
+        Missing embeddings are computed in one pass and the dense index is
+        searched once for the whole batch; the sparse retrievers and fusion
+        run per question.
+        """
+        with self._lock:
+            if not self._prepare():
+                return [None] * len(requests)
+            # reload() replaces these rather than mutating them, so the
+            # batch can run on this snapshot without holding the lock
+            index, function_data = self.index, self.function_data
+            name_index, bm25_index = self.name_index, self.bm25_index
+            adjacency, embeddings = self.call_adjacency, self.embeddings
+        missing = [question for question, _, vector, _ in requests if vector is None]
+        encoded = dict(zip(missing, self.encoder.encode(missing))) if missing else {}
+        query_embeddings = np.vstack([
+            np.asarray(vector if vector is not None else encoded[question][None], dtype="float32")
+            for question, _, vector, _ in requests
+        ])
+        candidates = max(k for _, k, _, _ in requests) * CANDIDATE_FACTOR
+        dense = dense_candidates(index, query_embeddings, candidates)
+
+        results = []
+        for (question, k, _, expand), query_embedding, row in zip(requests, query_embeddings, dense):
+            hits = search_functions(question, self.model, index, function_data, k,
+                                    name_index=name_index, bm25_index=bm25_index, dense=row)
+            if expand and adjacency is not None:
+                hits += expand_hits(hits, adjacency, query_embedding, embeddings, expand)
+            # records come from the same snapshot as the hits: a reload
+            # landing after the search can't shift the indexes under them
+            results.append((hits, [function_data[hit["index"]] for hit in hits]))
+        return results
+
+    def encode_queries(self, questions):
+        """Embed several questions in one forward pass (cached ones are free)."""
+        self.load_model()
+        return self.encoder.encode(questions)
+
+    def _retrieve(self, question, k, query_embedding=None, expand=EXPANSION_LIMIT):
+        """(functions, sources) for a question; functions is None if not indexed."""
+        result = self.search_batcher((question, k, query_embedding, expand))
+        if result is None:
+            return None, []
+        hits, functions = result
+        sources = [
+            dict(hit, file=func["file"], function=func["function_name"])
+            for hit, func in zip(hits, functions)
+        ]
+        return functions, sources
+
+    def _cache_lookup(self, question, expand=EXPANSION_LIMIT):
+        """(cached entry or None, query embedding or None, version)."""
+        with self._lock:
+            if not self._prepare():
+                return None, None, None
+            # answers built from expanded context are cached apart from plain ones
+            version = f"{self.index_version}+{expand or 0}"
+        # the embedding is needed for retrieval anyway, so the near-duplicate
+        # lookup costs no extra forward pass; encoded outside the lock so
+        # concurrent requests can share a batch
+        entry, vector = self.answer_cache.lookup(
+            question, version, embed=lambda: self.encoder.encode_one(question)
+        )
+        return entry, vector, version
+
+    def ask(self, question, k=3, expand=EXPANSION_LIMIT):
+        """Answer a question.
+
+        Returns a dict with the ``answer``, per-stage ``timings`` in ms, the
+        retrieved ``sources`` with their scores and whether it was ``cached``.
+        """
+        timings = {}
+        sources = []
+        cached = False
+        start = time.perf_counter()
+        try:
+            entry, vector, version = self._cache_lookup(question, expand)
+            if entry is not None:
+                answer, sources, cached = entry["answer"], entry["sources"], True
+                timings["cache_ms"] = (time.perf_counter() - start) * 1000
+            else:
+                functions, sources = self._retrieve(question, k, vector, expand)
+                timings["search_ms"] = (time.perf_counter() - start) * 1000
+                if functions is None:
+                    answer = NOT_INDEXED_ANSWER
+                else:
+                    llm_start = time.perf_counter()
+                    answer = answer_from_functions(question, functions)
+                    timings["llm_ms"] = (time.perf_counter() - llm_start) * 1000
+                    self.answer_cache.put(question, version, answer, sources, vector)
+        except Exception as e:
+            answer = f"❌ Error generating response: {e}"
+        timings["total_ms"] = (time.perf_counter() - start) * 1000
+        self._record(timings)
+        return {"answer": answer, "timings": timings, "sources": sources, "cached": cached}
+
+    def ask_stream(self, question, k=3, expand=EXPANSION_LIMIT):
+        """Answer a question as a stream of events.
+
+        Yields ``{"type": "sources", ...}`` once retrieval is done, then one
+        ``{"type": "token", "text": ...}`` per generated chunk, and finally
+        ``{"type": "done", "timings": ...}`` (preceded by an ``error`` event
+        if something failed). Timings include ``ttft_ms``, the time to the
+        first token. A cached answer arrives as a single token event.
+        """
+        timings = {}
+        cached = False
+        start = time.perf_counter()
+        try:
+            entry, vector, version = self._cache_lookup(question, expand)
+            if entry is not None:
+                cached = True
+                timings["cache_ms"] = (time.perf_counter() - start) * 1000
+                yield {"type": "sources", "sources": entry["sources"]}
+                yield {"type": "token", "text": entry["answer"]}
+            else:
+                functions, sources = self._retrieve(question, k, vector, expand)
+                timings["search_ms"] = (time.perf_counter() - start) * 1000
+                yield {"type": "sources", "sources": sources}
+                if functions is None:
+                    yield {"type": "token", "text": NOT_INDEXED_ANSWER}
+                else:
+                    parts = []
+                    llm_start = time.perf_counter()
+                    for text in stream_answer_from_functions(question, functions):
+                        if "ttft_ms" not in timings:
+                            timings["ttft_ms"] = (time.perf_counter() - start) * 1000
+                        parts.append(text)
+                        yield {"type": "token", "text": text}
+                    timings["llm_ms"] = (time.perf_counter() - llm_start) * 1000
+                    self.answer_cache.put(question, version, "".join(parts), sources, vector)
+        except Exception as e:
+            yield {"type": "error", "message": f"❌ Error generating response: {e}"}
+        timings["total_ms"] = (time.perf_counter() - start) * 1000
+        self._record(timings)
+        yield {"type": "done", "timings": timings, "cached": cached}
+
+    # ── latency reporting ──────────────────────────────────────
+    def _record(self, timings):
+        self._latencies.append(timings)
+        print("⏱️ /chat " + ", ".join(f"{k[:-3]} {v:.1f} ms" for k, v in timings.items()))
+
+    def latency_stats(self):
+        """p50/p95 per stage over the most recent requests."""
+        samples = list(self._latencies)
+        stats = {"requests": len(samples)}
+        for stage in ("cache_ms", "search_ms", "ttft_ms", "llm_ms", "total_ms"):
+            values = [s[stage] for s in samples if stage in s]
+            stats[stage] = {"p50": _percentile(values, 50), "p95": _percentile(values, 95)}
+        return stats
@@ -7,49 +7,107 @@ document.addEventListener('DOMContentLoaded', () => {
       .catch(err => console.error('Error fetching diagram data:', err));
   }
 
-  function buildDiagram(modules) {
+  const nodeColor = {
+    background: '#fff',
+    border: '#495057',
+    highlight: { background: '#e7f1ff', border: '#0d6efd' },
+  };
+  const clusterColor = {
+    background: '#f1f3f5',
+    border: '#0d6efd',
+    highlight: { background: '#e7f1ff', border: '#0d6efd' },
+  };
+
+  // graph = { level, nodes, edges } with calls resolved and positions
+  // precomputed server-side. level 'function' is the whole graph; otherwise
+  // nodes are module/package clusters, expanded one page at a time.
+  function buildDiagram(graph) {
     const nodeData = {};
-    const nodes = [],
-      edges = [];
-
-    modules.forEach(m => {
-      m.functions.forEach(f => {
-        const id = f.qualified_name;
-        nodeData[id] = f;
-        nodes.push({
-          id,
-          label: f.name,
-          shape: 'box',
-          color: {
-            background: '#fff',
-            border: '#495057',
-            highlight: { background: '#e7f1ff', border: '#0d6efd' },
-          },
-        });
-        (f.calls || []).forEach(c => {
-          const target = nodes.find(n => n.id === c)
-            ? c
-            : c.includes('.')
-            ? c
-            : `${m.name}.${c}`;
-          edges.push({
-            from: id,
-            to: target,
-            arrows: 'to',
-            color: { color: '#e63900' },
-            width: 3,
-            smooth: { enabled: true, type: 'dynamic' },
-          });
+    const clusterData = {};
+    const calleesOf = {};
+    const nodesDS = new vis.DataSet();
+    const edgesDS = new vis.DataSet();
+
+    function addFunctions(list) {
+      list.forEach(n => (nodeData[n.id] = n));
+      nodesDS.add(list.map(n => ({
+        id: n.id, label: n.label, x: n.x, y: n.y, shape: 'box', color: nodeColor,
+      })));
+    }
+
+    function addClusters(list) {
+      list.forEach(c => (clusterData[c.id] = c));
+      nodesDS.add(list.map(c => ({
+        id: c.id, label: c.label, x: c.x, y: c.y, shape: 'box',
+        color: clusterColor, borderWidth: 2, title: 'Click to expand',
+      })));
+    }
+
+    // attach each edge to whatever is rendered: the function or its cluster
+    function addEdges(list) {
+      list.forEach(e => {
+        if (clusterData[e.from]) return;
+        (calleesOf[e.from] = calleesOf[e.from] || new Set()).add(e.to);
+      });
+      const endpoint = (id, cluster) =>
+        nodesDS.get(id) ? id : cluster && nodesDS.get(cluster) ? cluster : null;
+      const fresh = [];
+      list.forEach(e => {
+        const from = endpoint(e.from, e.from_cluster),
+          to = endpoint(e.to, e.to_cluster);
+        if (!from || !to || (from === to && clusterData[from])) return;
+        const id = `${from}->${to}`;
+        if (edgesDS.get(id) || fresh.some(f => f.id === id)) return;
+        fresh.push({
+          id, from, to,
+          arrows: 'to',
+          color: { color: '#e63900' },
+          width: e.weight ? Math.min(1 + Math.log2(e.weight), 8) : 3,
+          smooth: { enabled: true, type: 'dynamic' },
         });
       });
-    });
+      edgesDS.add(fresh);
+    }
+
+    function expand(cluster, page) {
+      fetch(`/diagram-data?module=${encodeURIComponent(cluster.key)}&page=${page}`)
+        .then(r => {
+          if (!r.ok) throw new Error(`Server error: ${r.status}`);
+          return r.json();
+        })
+        .then(data => {
+          const stale = page ? `more:${cluster.key}:${page}` : cluster.id;
+          edgesDS.remove(edgesDS.getIds({ filter: e => e.from === stale || e.to === stale }));
+          nodesDS.remove(stale);
+          addFunctions(data.nodes);
+          if (page + 1 < data.pages) {
+            const shown = (page + 1) * data.nodes.length;
+            const more = { ...cluster, page: page + 1 };
+            clusterData[`more:${cluster.key}:${page + 1}`] = more;
+            nodesDS.add({
+              id: `more:${cluster.key}:${page + 1}`,
+              label: `… ${data.total - shown} more in ${cluster.key}`,
+              x: cluster.x, y: cluster.y, shape: 'box', color: clusterColor,
+            });
+          }
+          addEdges(data.edges);
+        })
+        .catch(err => console.error('Error expanding cluster:', err));
+    }
+
+    if (graph.level === 'function') {
+      addFunctions(graph.nodes);
+    } else {
+      addClusters(graph.nodes);
+    }
+    addEdges(graph.edges);
 
     const network = new vis.Network(
       networkEl,
-      { nodes: new vis.DataSet(nodes), edges: new vis.DataSet(edges) },
+      { nodes: nodesDS, edges: edgesDS },
       {
-        layout: { improvedLayout: true },
-        physics: { barnesHut: { springLength: 160 } },
+        layout: { improvedLayout: false },
+        physics: false,
         interaction: { hover: true },
       }
     );
@@ -62,12 +120,54 @@ document.addEventListener('DOMContentLoaded', () => {
       detailsPane.classList.add('hidden')
     );
 
+    // docstring + source are fetched per function; the URL names the
+    // workspace and the store's content version, so the browser can cache
+    // them until the code changes
+    const docEl = document.getElementById('d-doc');
+    const srcEl = document.getElementById('d-src');
+    let shownId = null;
+
+    function showSource(id, f) {
+      shownId = id;
+      docEl.textContent = 'Loading…';
+      if (srcEl) srcEl.textContent = '';
+      if (f.store_index === null || f.store_index === undefined) {
+        docEl.textContent = 'No description available';
+        return;
+      }
+      const params = new URLSearchParams({ workspace: graph.workspace });
+      if (graph.version) params.set('v', graph.version);
+      fetch(`/functions/${f.store_index}?${params}`)
+        .then(r => {
+          if (!r.ok) throw new Error(`Server error: ${r.status}`);
+          return r.json();
+        })
+        .then(src => {
+          if (shownId !== id) return;
+          if (src.docstring) {
+            docEl.innerHTML = '<strong>Description:</strong> ';
+            docEl.appendChild(document.createTextNode(src.docstring));
+          } else {
+            docEl.textContent = 'No description available';
+          }
+          if (srcEl) srcEl.textContent = src.code;
+        })
+        .catch(err => {
+          if (shownId === id) docEl.textContent = 'Could not load source';
+          console.error('Error fetching function source:', err);
+        });
+    }
+
     // clicking on nodes
     network.on('click', params => {
       params.event.stopPropagation();
       if (!params.nodes.length) return;
-      const id = params.nodes[0],
-        f = nodeData[id];
+      const id = params.nodes[0];
+      if (clusterData[id]) {
+        expand(clusterData[id], clusterData[id].page || 0);
+        return;
+      }
+      const f = nodeData[id];
       if (!f) return;
 
       // position pane
@@ -82,26 +182,68 @@ document.addEventListener('DOMContentLoaded', () => {
       ).textContent = `${f.module} (line ${f.line_number})`;
       document.getElementById('d-params').textContent =
         (f.params || []).join(', ') || 'None';
-      const docEl = document.getElementById('d-doc');
-      if (f.docstring) {
-        docEl.innerHTML = `<strong>Description:</strong> ${f.docstring}`;
-      } else {
-        docEl.textContent = 'No description available';
-      }
+      showSource(id, f);
 
       // calls list
       const ul = document.getElementById('d-calls');
       ul.innerHTML = '';
-      (f.calls || []).forEach(c => {
+      [...(calleesOf[id] || [])].sort().forEach(c => {
         const li = document.createElement('li');
         li.textContent = c;
         ul.appendChild(li);
       });
+      (f.external || []).forEach(c => {
+        const li = document.createElement('li');
+        li.textContent = `${c} (external)`;
+        ul.appendChild(li);
+      });
 
       detailsPane.classList.remove('hidden');
     });
   }
 
+  // Ingestion job progress (walkthrough page after an upload)
+  const jobEl = document.getElementById('job-status');
+  const jobId = new URLSearchParams(window.location.search).get('job');
+  if (jobEl && jobId) {
+    const icons = { pending: '⏳', running: '🔄', done: '✅', skipped: '➖', failed: '❌' };
+    jobEl.classList.remove('hidden');
+
+    function renderJob(job) {
+      document.getElementById('job-state').textContent =
+        job.status === 'failed'
+          ? `failed: ${job.error}`
+          : `${Math.round(job.progress * 100)}% (${job.elapsed.toFixed(1)}s)`;
+      const ul = document.getElementById('job-stages');
+      ul.innerHTML = '';
+      job.stages.forEach(s => {
+        const li = document.createElement('li');
+        li.className = s.status;
+        li.textContent = `${icons[s.status] || ''} ${s.name}` +
+          (s.seconds !== null ? ` — ${s.seconds.toFixed(2)}s` : '');
+        ul.appendChild(li);
+      });
+    }
+
+    function pollJob() {
+      fetch(`/jobs/${jobId}`)
+        .then(r => {
+          if (!r.ok) throw new Error(`Server error: ${r.status}`);
+          return r.json();
+        })
+        .then(job => {
+          renderJob(job);
+          if (job.status === 'queued' || job.status === 'running') {
+            setTimeout(pollJob, 1000);
+          }
+        })
+        .catch(err => {
+          document.getElementById('job-state').textContent = `❌ ${err.message}`;
+        });
+    }
+    pollJob();
+  }
+
   // Chat functionality
   const chatForm = document.getElementById('chat-form');
   if (chatForm) {
@@ -126,34 +268,56 @@ document.addEventListener('DOMContentLoaded', () => {
 
       addMsg('user', q);
       addMsg('bot', '⏳ Thinking...'); // Add loading indicator
+      const bubble = chatBox.lastChild;
+      let answer = '';
+
+      // one parsed server-sent event from /chat
+      function handleEvent(ev) {
+        if (ev.type === 'token') {
+          answer += ev.text;
+          bubble.textContent = answer;
+          chatBox.scrollTop = chatBox.scrollHeight;
+        } else if (ev.type === 'error') {
+          throw new Error(ev.message);
+        }
+      }
 
       input.value = '';
       fetch('/chat', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ question: q }),
+        headers: {
+          'Content-Type': 'application/json',
+          Accept: 'text/event-stream',
+        },
+        body: JSON.stringify({ question: q, stream: true }),
       })
-        .then(r => {
+        .then(async r => {
           if (!r.ok) throw new Error(`Server error: ${r.status}`);
-          return r.json();
-        })
-        .then(d => {
-          // Remove the loading message
-          chatBox.removeChild(chatBox.lastChild);
+          const reader = r.body.getReader();
+          const decoder = new TextDecoder();
+          let buffer = '';
 
-          if (!d || !d.answer) {
-            throw new Error('No answer in response');
+          // render tokens as they arrive; events are separated by a blank line
+          for (;;) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let sep;
+            while ((sep = buffer.indexOf('\n\n')) !== -1) {
+              const line = buffer.slice(0, sep).trim();
+              buffer = buffer.slice(sep + 2);
+              if (line.startsWith('data:')) {
+                handleEvent(JSON.parse(line.slice(5)));
+              }
+            }
           }
-          addMsg('bot', d.answer);
+          if (!answer) throw new Error('No answer in response');
         })
         .catch(err => {
           console.error('Chat error:', err);
-          // Remove the loading message if it exists
-          if (
-            chatBox.lastChild &&
-            chatBox.lastChild.textContent.includes('⏳')
-          ) {
-            chatBox.removeChild(chatBox.lastChild);
+          // Drop the bubble if nothing was streamed into it
+          if (!answer && bubble.parentNode) {
+            chatBox.removeChild(bubble);
           }
           addMsg('bot', `❌ Error: ${err.message}`);
         });
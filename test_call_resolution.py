@@ -0,0 +1,92 @@
+"""Call resolution through imports (run with ``python -m pytest``)."""
+import os
+import textwrap
+
+from function_mapper import ModuleAnalyzer, extract_file
+
+
+def resolve(files):
+    """{caller id: callee ids} for a tree given as {path: source}."""
+    analyzer = ModuleAnalyzer()
+    known_paths = {os.path.normpath(path) for path in files}
+    for path, source in files.items():
+        records, imports = extract_file(path, textwrap.dedent(source))
+        analyzer.add_file_records(path, records, known_paths, imports)
+    analyzer.resolve_calls()
+    return {f"{name}.{qualified}": sorted(func['callees'])
+            for name, module in analyzer.modules.items()
+            for qualified, func in module['functions'].items()}
+
+
+PACKAGE = {
+    'pkg/__init__.py': """
+        from .core import f
+        from .core import g as h
+    """,
+    'pkg/core.py': """
+        def f():
+            pass
+
+        def g():
+            pass
+    """,
+}
+
+
+def test_package_reexport_from_import():
+    callees = resolve(dict(PACKAGE, **{'app.py': """
+        from pkg import f
+
+        def main():
+            f()
+    """}))
+    assert callees['app.main'] == ['pkg.core.f']
+
+
+def test_package_reexport_attribute_call():
+    callees = resolve(dict(PACKAGE, **{'app.py': """
+        import pkg
+
+        def main():
+            pkg.f()
+            pkg.h()
+    """}))
+    assert callees['app.main'] == ['pkg.core.f', 'pkg.core.g']
+
+
+def test_reexport_cycle_is_external():
+    callees = resolve({
+        'a.py': "from b import f\n",
+        'b.py': "from a import f\n",
+        'app.py': """
+            from a import f
+
+            def main():
+                f()
+        """,
+    })
+    assert callees['app.main'] == []
+
+
+def test_relative_imports():
+    callees = resolve(dict(PACKAGE, **{'pkg/sub/__init__.py': "", 'pkg/sub/mod.py': """
+        from ..core import f
+        from .. import core
+
+        def main():
+            f()
+            core.g()
+    """}))
+    assert callees['pkg.sub.mod.main'] == ['pkg.core.f', 'pkg.core.g']
+
+
+def test_aliased_imports():
+    callees = resolve(dict(PACKAGE, **{'app.py': """
+        import pkg.core as c
+        from pkg.core import g as gg
+
+        def main():
+            c.f()
+            gg()
+    """}))
+    assert callees['app.main'] == ['pkg.core.f', 'pkg.core.g']
@@ -0,0 +1,125 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+from embed_functions import get_model
+from code_search import QueryEncoder
+from query_engine import QueryEngine
+
+# Named workspaces keep their artifacts in WORKSPACES_DIR/<name>/; the
+# default workspace uses the working directory, where the CLI scripts
+# read and write
+WORKSPACES_DIR    = "workspaces"
+DEFAULT_WORKSPACE = "default"
+
+# Loaded engines are evicted least-recently-used first once their artifacts
+# add up to more than the budget, and after sitting idle this long
+ENGINE_POOL_BUDGET_MB = 4096
+ENGINE_IDLE_SECONDS   = 3600
+
+_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def valid_workspace_name(name):
+    return bool(name and _NAME.match(name))
+
+
+def workspace_dir(name, create=False):
+    """Artifact directory of a workspace."""
+    if not valid_workspace_name(name):
+        raise ValueError(f"Invalid workspace name: {name!r}")
+    if name == DEFAULT_WORKSPACE:
+        return "."
+    path = os.path.join(WORKSPACES_DIR, name)
+    if create:
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def list_workspaces():
+    names = [DEFAULT_WORKSPACE]
+    if os.path.isdir(WORKSPACES_DIR):
+        names += sorted(n for n in os.listdir(WORKSPACES_DIR)
+                        if valid_workspace_name(n) and n != DEFAULT_WORKSPACE
+                        and os.path.isdir(os.path.join(WORKSPACES_DIR, n)))
+    return names
+
+
+class EnginePool:
+    """LRU pool of per-workspace QueryEngines under a memory budget.
+
+    All engines share one QueryEncoder, so the model is loaded once per
+    process. An evicted engine is only dropped from the pool: requests
+    still holding it finish normally, and the next request for that
+    workspace loads a fresh one.
+    """
+
+    def __init__(self, budget_mb=ENGINE_POOL_BUDGET_MB, idle_seconds=ENGINE_IDLE_SECONDS):
+        self.budget = budget_mb * 1024 * 1024
+        self.idle_seconds = idle_seconds
+        self._engines = OrderedDict()  # name -> engine
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self.encoder = None            # shared by every engine; created on first use
+        self.evictions = 0
+
+    def get(self, name):
+        """Engine for a workspace, loading it into the pool if needed."""
+        with self._lock:
+            engine = self._engines.get(name)
+            if engine is None:
+                if self.encoder is None:
+                    self.encoder = QueryEncoder(get_model())
+                engine = QueryEngine(artifact_dir=workspace_dir(name), encoder=self.encoder)
+                self._engines[name] = engine
+            self._engines.move_to_end(name)
+            self._last_used[name] = time.time()
+            self._evict(keep=name)
+            return engine
+
+    def reload(self, name):
+        """Pick up new artifacts for a workspace if its engine is loaded."""
+        with self._lock:
+            engine = self._engines.get(name)
+        if engine is not None:
+            engine.reload()
+        with self._lock:
+            self._evict(keep=name)
+
+    def _evict(self, keep):
+        now = time.time()
+        for name in list(self._engines):
+            if name != keep and now - self._last_used.get(name, now) > self.idle_seconds:
+                self._drop(name)
+        total = sum(engine.memory_estimate() for engine in self._engines.values())
+        for name in list(self._engines):
+            if total <= self.budget:
+                break
+            if name != keep:
+                total -= self._engines[name].memory_estimate()
+                self._drop(name)
+
+    def _drop(self, name):
+        del self._engines[name]
+        self._last_used.pop(name, None)
+        self.evictions += 1
+        print(f"♻️ Evicted query engine for workspace '{name}'")
+
+    def stats(self):
+        with self._lock:
+            engines = {
+                name: {
+                    "ready": engine.ready,
+                    "memory_mb": round(engine.memory_estimate() / (1024 * 1024), 1),
+                    "idle_seconds": round(time.time() - self._last_used.get(name, time.time()), 1),
+                }
+                for name, engine in self._engines.items()
+            }
+        return {
+            "loaded": len(engines),
+            "budget_mb": self.budget // (1024 * 1024),
+            "evictions": self.evictions,
+            "engines": engines,
+        }